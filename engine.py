@@ -1,169 +1,1383 @@
 import os
+import re
+import mmap
+import shutil
+import heapq
+import multiprocessing
+import marshal
 import time
-import json
+import struct
+import threading
 import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from lru_cache import LRUCache
+from keydir import CompactKeydir, DiskKeydir, SortedKeys
+
+
+# ----------------------------------------------------------------
+# RECORD FORMAT — fixed binary header followed by raw key/value bytes
+# ----------------------------------------------------------------
+# crc32 | timestamp | expiry | key_size | value_size | flags | key | value
+# The CRC covers everything after itself (rest of header + key + value).
+HEADER = struct.Struct(">IIIHIB")
+META = struct.Struct(">IIHIB")  # header without the leading crc field
+
+MAX_KEY_SIZE = 0xFFFF        # key_size is a u16
+MAX_VALUE_SIZE = 0xFFFFFFFF  # value_size is a u32
+MAX_EXPIRY = 0xFFFFFFFF      # expiry is u32 Unix seconds (0 = never), good until 2106
+
+FLAG_TOMBSTONE = 1  # record is a delete marker, value is empty
+FLAG_BATCH = 2      # record is a WriteBatch frame: empty key, value = the batch's records back to back
+
+DEFAULT_MAX_FILE_SIZE = 64 * 1024 * 1024  # active file rolls over past this size
+
+# Logs written before the binary format were a single text file at `filename` itself,
+# one "<length> <checksum>" line before each JSON record
+LEGACY_HEADER = re.compile(rb"\d+ \d+\r?\n")
+
+# Hint files ("<data file>.hint") list every record of a sealed data file without its value:
+# header_offset | value_size | expiry | key_size | flags | key
+# followed by a trailer with the size of the data file they describe and a crc32.
+HINT = struct.Struct(">QIIHB")
+HINT_TRAILER = struct.Struct(">QI")
+HINT_CHUNK = 256 * 1024  # iteration reads hints this much at a time (> the largest entry)
+
+DEFAULT_CHECKPOINT_BYTES = 64 * 1024 * 1024  # checkpoint the index after this many appended bytes
+CHECKPOINT_VERSION = 2  # bumped whenever the shape of index entries changes
+
+LOCK_STRIPES = 64  # index/cache locks are striped by key hash
+
+# Index implementations: a plain dict (fastest), CompactKeydir (typed arrays, several
+# times less memory per key, for stores with tens of millions of keys) or DiskKeydir
+# (memory-mapped bucket pages + hot-entry cache, for keyspaces larger than RAM)
+KEYDIR_DICT = "dict"
+KEYDIR_COMPACT = "compact"
+KEYDIR_DISK = "disk"
+KEYDIRS = (KEYDIR_DICT, KEYDIR_COMPACT, KEYDIR_DISK)
+
+DEFAULT_COMPACTION_THRESHOLD = 0.5  # compact a sealed file once this share of it is dead bytes
+
+SCAN_BUFFER_SIZE = 1024 * 1024  # chunk size when compaction has to copy through Python
+
+# Startup scans data files without a hint in parallel worker processes once there is
+# at least PARALLEL_LOAD_MIN_BYTES to scan, split into ranges of LOAD_RANGE_BYTES
+PARALLEL_LOAD_MIN_BYTES = 32 * 1024 * 1024
+LOAD_RANGE_BYTES = 16 * 1024 * 1024
+
+# Durability policies (same idea as Redis appendfsync):
+#   always   → write + fsync for every commit
+#   batch    → group commit: concurrent writers share one write + fsync
+#   everysec → write per commit, a background thread fsyncs once a second
+#   none     → write per commit, the OS decides when data hits the disk
+FSYNC_ALWAYS = "always"
+FSYNC_BATCH = "batch"
+FSYNC_EVERYSEC = "everysec"
+FSYNC_NONE = "none"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_EVERYSEC, FSYNC_NONE)
+
+
+def encode_record(key_bytes, value_bytes, expiry=0, flags=0):
+    """Build one on-disk record from already-encoded key/value bytes."""
+    if len(key_bytes) > MAX_KEY_SIZE:
+        raise ValueError(f"key is {len(key_bytes)} bytes, the limit is {MAX_KEY_SIZE}")
+    if len(value_bytes) > MAX_VALUE_SIZE:
+        raise ValueError(f"value is {len(value_bytes)} bytes, the limit is {MAX_VALUE_SIZE}")
+    meta = META.pack(int(time.time()), expiry, len(key_bytes), len(value_bytes), flags)
+    checksum = zlib.crc32(value_bytes, zlib.crc32(key_bytes, zlib.crc32(meta)))
+    return struct.pack(">I", checksum) + meta + key_bytes + value_bytes
+
+
+def expiry_for(ttl):
+    """Absolute expiry for a TTL in seconds (0 = no expiry). Clamped to what the header
+       holds: a negative TTL expires at once, a huge one in 2106."""
+    if not ttl:
+        return 0
+    return min(max(int(time.time()) + int(ttl), 1), MAX_EXPIRY)
+
+
+def _valid_record_end(buf, pos, size):
+    """End offset of the intact record starting at `pos`, or None if there is none."""
+    if pos + HEADER.size > size:
+        return None
+    checksum, _, _, key_size, value_size, flags = HEADER.unpack_from(buf, pos)
+    end = pos + HEADER.size + key_size + value_size
+    if end > size or flags & ~(FLAG_TOMBSTONE | FLAG_BATCH):
+        return None
+    if zlib.crc32(buf[pos + 4:end]) != checksum:
+        return None
+    return end
+
+
+def iter_records(view, pos, stop, size):
+    """Parse intact records starting in [pos, stop) straight out of a memoryview of a data
+       file (no per-record reads, values are never copied), yielding
+       (record_pos, record_end, header_offset, key_size, value_size, expiry, flags).
+       WriteBatch frames are checked as a whole and yield their inner records, which share
+       the frame's record_pos/record_end. Stops at the first torn or corrupted record."""
+    header_size = HEADER.size
+    unpack_from = HEADER.unpack_from
+    crc32 = zlib.crc32
+
+    while pos < stop and pos + header_size <= size:
+        checksum, _, expiry, key_size, value_size, flags = unpack_from(view, pos)
+        end = pos + header_size + key_size + value_size
+        if end > size or crc32(view[pos + 4:end]) != checksum:
+            return  # truncated record (crash mid-write) or corruption
+
+        if not flags & FLAG_BATCH:
+            yield pos, end, pos, key_size, value_size, expiry, flags
+        else:
+            inner = pos + header_size  # frames have an empty key
+            while inner < end:
+                _, _, expiry, key_size, value_size, flags = unpack_from(view, inner)
+                yield pos, end, inner, key_size, value_size, expiry, flags
+                inner += header_size + key_size + value_size
+        pos = end
+
+
+def scan_range(path, file_id, start, stop, hints=False):
+    """Worker for parallel index loading: scan the records of a data file that start in
+       [start, stop). A start inside a record resynchronizes on the next intact header.
+       Returns (first, end, puts, deletes, entries): where the scan began and stopped, the
+       range's net effect on the index (index entries of the keys it last writes, keys it
+       last deletes) and, if `hints`, hint-format entries of every record in it."""
+    puts = {}
+    deletes = set()
+    entries = bytearray()
+    header_size = HEADER.size
+
+    with open(path, "rb") as read_file:
+        size = os.fstat(read_file.fileno()).st_size
+        with mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ) as buf, memoryview(buf) as view:
+            first = start
+            if start > 0:
+                while first < stop and _valid_record_end(view, first, size) is None:
+                    first += 1
+
+            end = first
+            for _, end, header_offset, key_size, value_size, expiry, flags in iter_records(view, first, stop, size):
+                key_start = header_offset + header_size
+                key = buf[key_start:key_start + key_size].decode()
+                if flags & FLAG_TOMBSTONE:
+                    puts.pop(key, None)
+                    deletes.add(key)
+                else:
+                    deletes.discard(key)
+                    puts[key] = (file_id, header_offset, key_start + key_size, value_size, expiry)
+                if hints:
+                    entries += HINT.pack(header_offset, value_size, expiry, key_size, flags)
+                    entries += view[key_start:key_start + key_size]
+
+    return first, end, puts, deletes, bytes(entries)
+
+
+class WriteBatch:
+    """Puts and deletes collected up front and committed atomically by KVStore.write()."""
+
+    def __init__(self):
+        self.records = []  # encoded records, in order
+        self.ops = []      # (offset of record inside the batch, key, value or None for delete)
+        self.size = 0
+
+    def put(self, key, value, ttl=None):
+        expiry = expiry_for(ttl)
+        # bytes are stored as-is (read back with get(key, raw=True)); anything else as text
+        if isinstance(value, bytes):
+            data = value
+        else:
+            value = str(value)
+            data = value.encode()
+        self._add(key, value, encode_record(key.encode(), data, expiry))
+
+    def delete(self, key):
+        self._add(key, None, encode_record(key.encode(), b"", flags=FLAG_TOMBSTONE))
+
+    def _add(self, key, value, record):
+        self.ops.append((self.size, key, value))
+        self.records.append(record)
+        self.size += len(record)
+
+    def __len__(self):
+        return len(self.records)
+
+
+class _PendingWrite:
+    """One writer's data waiting in the group-commit queue."""
+    __slots__ = ("data", "ops", "done", "error")
+
+    def __init__(self, data, ops):
+        self.data = data
+        self.ops = ops
+        self.done = False
+        self.error = None
 
 
 class KVStore:
-    def __init__(self, filename="data.log"):
-        self.filename = filename
-        
-        # Open file in append mode → all writes go to end of file (append-only log)
-        # buffering=1 → line-buffered writes → flushes on every newline, safer for durability
-        self.write_file = open(self.filename, "a+", buffering=1)
-        self.read_file = open(self.filename, "r", buffering=1)
+    def __init__(self, filename="data.log", max_file_size=DEFAULT_MAX_FILE_SIZE,
+                 checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES, use_mmap=False,
+                 fsync=FSYNC_NONE, group_commit_window=0.0,
+                 compaction_threshold=DEFAULT_COMPACTION_THRESHOLD, load_workers=None,
+                 keydir=KEYDIR_DICT, lazy_load=False, ordered=False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        if keydir not in KEYDIRS:
+            raise ValueError(f"keydir must be one of {KEYDIRS}, got {keydir!r}")
 
-        # In-memory index: key -> (header_offset, json_offset, expiry)
+        self.filename = filename
+        self.fsync = fsync
+        self.group_commit_window = group_commit_window  # seconds a batch leader waits for company
+        self.max_file_size = max_file_size
+        self.use_mmap = use_mmap  # serve cache misses from memory-mapped data files
+        self.checkpoint_bytes = checkpoint_bytes
+        self.checkpoint_path = filename + ".checkpoint"
+        self.compaction_threshold = compaction_threshold  # None disables automatic compaction
+        self.load_workers = load_workers or os.cpu_count() or 1  # processes scanning the log at startup
+        self.keydir = keydir
+        self.keydir_path = filename + ".keydir"  # index file of keydir="disk"
+        self.bytes_since_checkpoint = 0
+        self.last_checkpoint_size = 0  # bytes of the last checkpoint written
+
+        # Concurrency: one writer at a time appends to the active file, while readers
+        # only take the stripe lock of their key (lookup + pread + cache fill).
+        # Lock order is always write_lock → stripe(s).
+        self.write_lock = threading.Lock()
+        self.stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+        # Group commit queue (fsync="batch"): the first waiting writer becomes the
+        # leader and commits everything queued behind it with one write + fsync
+        self.commit_cond = threading.Condition()
+        self.pending = []
+        self.committing = False
+
+        self.closed = threading.Event()
+
+        # At most one compaction at a time (foreground or background)
+        self.compaction_lock = threading.Lock()
+        self.compaction_thread = None
+
+        # Space accounting per data file: total size and bytes of records the index still
+        # points at. Everything else (overwritten, deleted, expired, tombstones) is dead.
+        self.file_sizes = {}
+        self.live_bytes = {}
+        # Live records with a TTL, so expiry counts as dead space even for keys nobody reads:
+        # file_id -> {expiry: bytes} until that second passes, then swept into expired_bytes
+        # (still in the index, but dead). expiry_heap holds (expiry, file_id) to sweep next.
+        self.ttl_bytes = {}
+        self.expired_bytes = {}
+        self.expiry_heap = []
+        self.ttl_keys = {}  # expiry -> live keys expiring then (not swept yet), for stats()
+        self.space_lock = threading.Lock()  # leaf lock, taken last
+        self.compaction_candidates = set()  # sealed files over the dead-ratio threshold
+
+        # The log is split into numbered data files: "<filename>.1", "<filename>.2", ...
+        # Only the highest-numbered (active) file is appended to; the rest are immutable.
+        self._check_legacy_log()
+        self.file_ids = self._list_file_ids()
+        if not self.file_ids:
+            self.file_ids = [1]
+        self.active_id = self.file_ids[-1]
+
+        # Open active file in binary append mode → all writes go to end of file (append-only log)
+        # Binary mode gives real byte offsets from tell(), so index offsets can be used
+        # directly with seek() (and later pread/mmap). We flush explicitly after each record.
+        self.write_file = open(self._data_path(self.active_id), "ab")
+        self.fds = {}  # file_id -> raw read-only fd for os.pread (no shared file position)
+        self.mmaps = {}  # file_id -> read-only mmap (use_mmap mode), mapped lazily
+        self.verified_hints = {}  # file_id -> (inode, size, mtime) of its hint file iteration checksummed
+        self.active_hints = bytearray()  # hint entries for the active file, written out on rollover
+
+        # In-memory index: key -> (file_id, header_offset, value_offset, value_size, expiry)
         # This is the same idea as Bitcask: index stays in RAM, values stay on disk.
-        self.index = {}
-        self._load_index()  # Build index from existing log at startup (crash recovery)
+        # There is no separate sequence number: (file_id, header_offset) already orders every
+        # record in log order (files are numbered in write order and compaction keeps a file's
+        # id and its records' relative order), and storing one more int per key would cost
+        # every keydir memory without any reader needing it.
+        self.index = None
+        self.ready = threading.Event()  # set once the index covers the whole log
+        self.load_aborted = False  # close() stopped a lazy load: `ready` only wakes waiters
+        # lazy_load only, while loading: index entries at or past load_floor are final, and
+        # `deleted` holds keys whose newest record is a delete (met by the loader, or since
+        # startup). No set of every key: with keydir="disk" RAM stays bounded while loading.
+        self.deleted = None
+        self.load_floor = (0, 0)
+        self.torn_id = None  # lazy_load: the old active file, sealed since it may end torn
+        self.load_progress = 0.0  # share of the log indexed so far
+        self.load_thread = None
+        if not lazy_load:
+            self._load_index()  # Build index from existing log at startup (crash recovery)
+
+        # Optional ordered view of the keys for scan(); the hash index stays the source of truth
+        self.sorted_keys = SortedKeys(self.index.keys() if self.index is not None else ()) if ordered else None
 
         self.cache = LRUCache(capacity=1000)  # LRU cache for faster GETs
         self.put_count = 0
         self.delete_count = 0
         self.last_compaction_time = None
+        self.files_rewritten = 0  # bumped by every compaction swap (iterators re-read their file)
+
+        if self.fsync == FSYNC_EVERYSEC:
+            threading.Thread(target=self._fsync_every_second, daemon=True).start()
+
+        if lazy_load:
+            self._start_lazy_load()  # returns at once; the index is built in the background
+        else:
+            self.load_progress = 1.0
+            self.ready.set()
+            for file_id in self.file_ids:
+                self._check_dead_ratio(file_id)
 
 
     # ----------------------------------------------------------------
-    # INDEX LOADING — Replay the log file at startup to rebuild index
+    # DATA FILES — numbered segments next to `filename`
     # ----------------------------------------------------------------
-    def _load_index(self):
-        """Scan the entire log file and rebuild the in-memory index.
-           This acts as crash recovery because we replay the log."""
-        self.index = {}
-        self.read_file.seek(0)
+    def _data_path(self, file_id):
+        return f"{self.filename}.{file_id}"
+
+    def _list_file_ids(self):
+        """Find existing data files for this store, oldest first."""
+        directory = os.path.dirname(self.filename) or "."
+        pattern = re.compile(re.escape(os.path.basename(self.filename)) + r"\.(\d+)$")
+
+        file_ids = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                file_ids.append(int(match.group(1)))
+        return sorted(file_ids)
+
+    def _check_legacy_log(self):
+        """Refuse to start over a log in the old text format: it lives at `filename` itself,
+           which this format never reads, so its data would silently disappear."""
+        try:
+            with open(self.filename, "rb") as legacy_file:
+                first_line = legacy_file.readline(64)
+        except (FileNotFoundError, IsADirectoryError):
+            return
+        if LEGACY_HEADER.fullmatch(first_line):
+            raise ValueError(f"{self.filename} is a log in the old text format, which this version "
+                             f"cannot read; export its data and remove it, or use another filename")
+
+    def _torn_tail(self, file_id, offset):
+        """True if the invalid bytes from `offset` on are a torn tail (a crash in the middle
+           of an append): a record that runs past the end of the file, or anything without an
+           intact record after it. Damage followed by intact records is not, and must not be
+           cut off."""
+        with open(self._data_path(file_id), "rb") as read_file:
+            size = os.fstat(read_file.fileno()).st_size
+            with mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ) as buf, memoryview(buf) as view:
+                if offset + HEADER.size > size:
+                    return True
+                _, _, _, key_size, value_size, _ = HEADER.unpack_from(view, offset)
+                if offset + HEADER.size + key_size + value_size > size:
+                    return True
+                # The record fits but fails its checksum: look for an intact one after it
+                return all(_valid_record_end(view, pos, size) is None for pos in range(offset + 1, size))
+
+    def _keep_damaged(self, file_id):
+        """Keep the original bytes of a data file damaged before its end as
+           "<data file>.corrupt" (a hard link where possible, else a copy): the records after
+           the damage are never indexed, and compaction would otherwise drop them."""
+        path = self._data_path(file_id)
+        if os.path.exists(path + ".corrupt"):
+            return
+        try:
+            os.link(path, path + ".corrupt")
+        except OSError:
+            shutil.copyfile(path, path + ".corrupt")
+
+    def _reader(self, file_id):
+        """Return (and cache) a raw read-only fd for a data file."""
+        fd = self.fds.get(file_id)
+        if fd is None:
+            fd = os.open(self._data_path(file_id), os.O_RDONLY)
+            # Another thread may have opened it first; keep theirs
+            winner = self.fds.setdefault(file_id, fd)
+            if winner != fd:
+                os.close(fd)
+            fd = winner
+        return fd
+
+    def _mapped(self, file_id, end):
+        """Return a read-only mmap of a data file covering at least `end` bytes.
+           The active file keeps growing, so its map is redone when a read goes past it.
+           A replaced map is not closed here: another reader may still be slicing it,
+           it is unmapped once the last reference goes away."""
+        mapped = self.mmaps.get(file_id)
+        if mapped is None or len(mapped) < end:
+            mapped = mmap.mmap(self._reader(file_id), 0, access=mmap.ACCESS_READ)
+            self.mmaps[file_id] = mapped
+        return mapped
+
+    def _stripe(self, key):
+        return self.stripes[hash(key) % LOCK_STRIPES]
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the write lock and every stripe: nothing reads or writes meanwhile."""
+        with self.write_lock:
+            for lock in self.stripes:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in self.stripes:
+                    lock.release()
+
+    def _rollover(self):
+        """Seal the active file and start appending to a new one."""
+        if self.fsync != FSYNC_NONE:
+            self.write_file.flush()
+            os.fsync(self.write_file.fileno())  # sealed files are never fsynced again
+        self.write_file.close()
+        self._write_hint(self.active_id, self.active_hints)
+        self.active_hints = bytearray()
 
-        while True:
-            header_offset = self.read_file.tell()  # Start position of header
-            
-            header = self.read_file.readline()
-            if not header:
-                break  # End of file reached
+        sealed_id = self.active_id
+        self.active_id += 1
+        self.file_ids.append(self.active_id)
+        self.file_sizes[self.active_id] = 0
+        self.write_file = open(self._data_path(self.active_id), "ab")
+
+        self._check_dead_ratio(sealed_id)  # no longer active, so it may be compacted
 
-            # Header format: "<length> <checksum>"
-            parts = header.strip().split()
-            if len(parts) != 2:
-                break  # Corrupted or unexpected entry
 
-            try:
-                length = int(parts[0])
-                checksum = int(parts[1])
-            except:
-                break  # Corrupted header → stop loading further
 
-            json_offset = self.read_file.tell()  # JSON begins right after header
-            json_data = self.read_file.read(length)
+    # ----------------------------------------------------------------
+    # WRITE PATH — append, fsync policy and group commit
+    # ----------------------------------------------------------------
+    def _write(self, data, ops):
+        """Append `data` (one or more encoded records) and, once it is committed
+           according to the fsync policy, apply `ops` to the index and cache.
+           `ops` is a list of (record_offset_in_data, key, value) — value is None for deletes."""
+        if self.fsync == FSYNC_BATCH:
+            self._group_commit(_PendingWrite(data, ops))
+            return
+
+        with self.write_lock:
+            file_id, offset = self._append(data)
+            if self.fsync == FSYNC_ALWAYS:
+                os.fsync(self.write_file.fileno())
+            self._apply(file_id, offset, data, ops)
+            self._maybe_checkpoint()
+
+    def _group_commit(self, pending):
+        with self.commit_cond:
+            self.pending.append(pending)
+            while self.committing and not pending.done:
+                self.commit_cond.wait()
+            if not pending.done:
+                self.committing = True  # we lead the next group
+
+        if not pending.done:
+            group = []
+            error = None
+            try:
+                if self.group_commit_window:
+                    time.sleep(self.group_commit_window)  # let more writers queue up
+
+                with self.commit_cond:
+                    group, self.pending = self.pending, []
+
+                # One write + one fsync for the whole group, then apply in log order
+                with self.write_lock:
+                    file_id, offset = self._append(b"".join(p.data for p in group))
+                    os.fsync(self.write_file.fileno())
+                    for p in group:
+                        self._apply(file_id, offset, p.data, p.ops)
+                        offset += len(p.data)
+                    self._maybe_checkpoint()
+            except Exception as e:
+                error = e
+            finally:
+                with self.commit_cond:
+                    for p in group:
+                        p.done = True
+                        p.error = error
+                    self.committing = False
+                    self.commit_cond.notify_all()
+
+        if pending.error is not None:
+            raise pending.error
+
+    def _append(self, data):
+        """Append raw bytes to the active file, rolling over when it is full.
+           Returns (file_id, offset) where the bytes start."""
+        if self.write_file.tell() >= self.max_file_size:
+            self._rollover()
+
+        offset = self.write_file.tell()
+        self.write_file.write(data)
+        self.write_file.flush()  # hand data to the OS so pread/mmap readers see it
+        self.file_sizes[self.active_id] = offset + len(data)
+
+        self.bytes_since_checkpoint += len(data)
+        return self.active_id, offset
+
+    def _apply(self, file_id, offset, data, ops):
+        """Point the index (and cache) at freshly written records. Caller holds write_lock."""
+        for record_offset, key, value in ops:
+            _, _, expiry, key_size, value_size, flags = HEADER.unpack_from(data, record_offset)
+            header_offset = offset + record_offset
+            self._add_hint(self.active_hints, header_offset,
+                           data[record_offset:record_offset + HEADER.size + key_size])
+
+            with self._stripe(key):
+                if self.deleted is not None and flags & FLAG_TOMBSTONE:
+                    self.deleted.add(key)  # lazy_load: older records of this key no longer matter
+
+                if self.sorted_keys is not None:
+                    if flags & FLAG_TOMBSTONE:
+                        self.sorted_keys.discard(key)
+                    else:
+                        self.sorted_keys.add(key)
+
+                if flags & FLAG_TOMBSTONE:
+                    # Remove from index & cache
+                    old_entry = self.index.pop(key, None)
+                    self.cache.delete(key)
+                    self.delete_count += 1
+                else:
+                    # Value offset = header_offset + fixed header + key bytes
+                    value_offset = header_offset + HEADER.size + key_size
+                    old_entry = self.index.get(key)
+                    self.index[key] = (file_id, header_offset, value_offset, value_size, expiry)
+                    self._add_live(file_id, value_offset + value_size - header_offset, expiry)
+                    if isinstance(value, str):
+                        self.cache.put(key, value)
+                    else:
+                        self.cache.delete(key)  # the cache holds text; raw values are read from disk
+                    self.put_count += 1
+
+                if old_entry is not None:
+                    self._drop_live(old_entry)  # previous version just became garbage
+
+        self._sweep_expired()
+
+    def _maybe_checkpoint(self):
+        """Called by writers (under write_lock) once the index reflects their records.
+           A checkpoint snapshots the whole index while writers wait, so it is never written
+           more often than once per its own size of appended log: write amplification stays
+           under 2x and the stall is amortized however many keys there are."""
+        if self.bytes_since_checkpoint >= max(self.checkpoint_bytes, self.last_checkpoint_size):
+            self._checkpoint()
+
+    def _fsync_every_second(self):
+        """Background flusher for fsync="everysec"."""
+        while not self.closed.wait(1.0):
+            with self.write_lock:
+                if self.write_file.closed:
+                    return
+                # dup: the fd stays valid even if a rollover closes the file meanwhile
+                fd = os.dup(self.write_file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
-            if len(json_data) != length:
-                break  # Truncated JSON (unexpected EOF)
 
-            # Verify checksum for corruption detection
-            if zlib.crc32(json_data.encode()) != checksum:
-                break
+    # ----------------------------------------------------------------
+    # SPACE ACCOUNTING — live vs dead bytes per data file
+    # ----------------------------------------------------------------
+    def _add_live(self, file_id, size, expiry=0):
+        with self.space_lock:
+            self.live_bytes[file_id] = self.live_bytes.get(file_id, 0) + size
+            if expiry:
+                self._add_ttl_bytes(file_id, expiry, size)
+
+    def _add_ttl_bytes(self, file_id, expiry, size):
+        """Caller holds space_lock."""
+        buckets = self.ttl_bytes.setdefault(file_id, {})
+        if expiry not in buckets:
+            heapq.heappush(self.expiry_heap, (expiry, file_id))
+        buckets[expiry] = buckets.get(expiry, 0) + size
+        self.ttl_keys[expiry] = self.ttl_keys.get(expiry, 0) + 1
+
+    def _drop_live(self, entry):
+        """A record the index pointed at is no longer live (overwritten, deleted or expired)."""
+        file_id, header_offset, value_offset, value_size, expiry = entry
+        size = value_offset + value_size - header_offset
+        with self.space_lock:
+            self.live_bytes[file_id] = self.live_bytes.get(file_id, 0) - size
+            if expiry:
+                buckets = self.ttl_bytes.get(file_id, {})
+                if expiry in buckets:
+                    buckets[expiry] -= size  # not swept yet
+                    self.ttl_keys[expiry] -= 1
+                else:
+                    self.expired_bytes[file_id] = self.expired_bytes.get(file_id, 0) - size
+        self._check_dead_ratio(file_id)
+
+    def _sweep_expired(self):
+        """Count live records whose TTL has passed as dead, whether or not anyone reads them.
+           Cheap when nothing expired: one look at the top of the heap."""
+        now = time.time()
+        if not self.expiry_heap or self.expiry_heap[0][0] >= now:
+            return
+        swept = set()
+        with self.space_lock:
+            while self.expiry_heap and self.expiry_heap[0][0] < now:
+                expiry, file_id = heapq.heappop(self.expiry_heap)
+                size = self.ttl_bytes.get(file_id, {}).pop(expiry, 0)
+                self.expired_bytes[file_id] = self.expired_bytes.get(file_id, 0) + size
+                self.ttl_keys.pop(expiry, None)
+                swept.add(file_id)
+        for file_id in swept:
+            self._check_dead_ratio(file_id)
+
+    def _forget_file_space(self, file_id):
+        """A data file was removed: drop its accounting. Caller holds every stripe."""
+        with self.space_lock:
+            self.file_sizes.pop(file_id, None)
+            self.live_bytes.pop(file_id, None)
+            self.ttl_bytes.pop(file_id, None)  # its heap entries find nothing when popped
+            self.expired_bytes.pop(file_id, None)
+        self.compaction_candidates.discard(file_id)
+
+    def _count_live_bytes(self):
+        """Recompute live bytes of every data file from the index (after loading it)."""
+        live_bytes = dict.fromkeys(self.file_ids, 0)
+        ttl_entries = []
+        for file_id, header_offset, value_offset, value_size, expiry in self.index.values():
+            size = value_offset + value_size - header_offset
+            live_bytes[file_id] = live_bytes.get(file_id, 0) + size
+            if expiry:
+                ttl_entries.append((file_id, expiry, size))
+
+        with self.space_lock:
+            self.live_bytes = live_bytes
+            self.ttl_bytes, self.expired_bytes, self.expiry_heap, self.ttl_keys = {}, {}, [], {}
+            for file_id, expiry, size in ttl_entries:
+                self._add_ttl_bytes(file_id, expiry, size)
+            self.file_sizes = {f: os.path.getsize(self._data_path(f)) for f in self.file_ids}
+        self._sweep_expired()
+
+    def _check_dead_ratio(self, file_id):
+        """Queue a sealed file for background compaction once enough of it is dead."""
+        if self.compaction_threshold is None or file_id == self.active_id or not self.ready.is_set():
+            return  # (space accounting is only complete once the index is loaded)
+
+        size = self.file_sizes.get(file_id, 0)
+        dead = size - self.live_bytes.get(file_id, 0) + self.expired_bytes.get(file_id, 0)
+        if size and dead / size >= self.compaction_threshold:
+            self.compaction_candidates.add(file_id)
+            self._schedule_compaction()
+
+    def _schedule_compaction(self):
+        """Start a background worker for queued candidates unless one is already running."""
+        if self.closed.is_set() or not self.compaction_lock.acquire(blocking=False):
+            return  # a running worker picks up new candidates before it exits
+        # Published only once started: close() may join it from another thread at any time
+        thread = threading.Thread(target=self._compaction_worker, args=(True,), daemon=True)
+        thread.start()
+        self.compaction_thread = thread
 
-            # Skip newline after JSON
-            self.read_file.readline()
 
-            try:
-                record = json.loads(json_data)
-            except:
-                break  # Corrupted JSON
+    # ----------------------------------------------------------------
+    # HINT FILES — keys + locations of a sealed data file, no values
+    # ----------------------------------------------------------------
+    def _hint_path(self, file_id):
+        return self._data_path(file_id) + ".hint"
+
+    @staticmethod
+    def _add_hint(hints, header_offset, record):
+        """Append the hint entry for a record (taken from its own header)."""
+        _, _, expiry, key_size, value_size, flags = HEADER.unpack_from(record)
+        hints += HINT.pack(header_offset, value_size, expiry, key_size, flags)
+        hints += record[HEADER.size:HEADER.size + key_size]
+
+    def _write_hint(self, file_id, hints):
+        """Persist hint entries for a sealed data file (atomically via rename)."""
+        data_size = os.path.getsize(self._data_path(file_id))
+        trailer = HINT_TRAILER.pack(data_size, zlib.crc32(hints, zlib.crc32(struct.pack(">Q", data_size))))
+
+        temp_filename = self._hint_path(file_id) + ".tmp"
+        with open(temp_filename, "wb") as hint_file:
+            hint_file.write(hints)
+            hint_file.write(trailer)
+        os.replace(temp_filename, self._hint_path(file_id))
+
+    def _load_hint(self, file_id):
+        """Rebuild index entries of one data file from its hint file.
+           Returns False when there is no usable hint (caller replays the data file)."""
+        entries = self._read_hint(file_id)
+        if entries is None:
+            return False
+
+        for header_offset, key, key_size, value_size, expiry, flags in entries:
+            self._index_record(file_id, header_offset, key, key_size, value_size, expiry, flags)
+        return True
+
+    def _read_hint(self, file_id):
+        """Entries of a data file's hint as (header_offset, key, key_size, value_size, expiry, flags),
+           in file order. None when there is no usable hint."""
+        hint = self._read_hint_data(file_id)
+        if hint is None:
+            return None
+        return list(self._hint_entries(*hint))
+
+    def _read_hint_data(self, file_id):
+        """Raw hint entries of a data file as (data, end): entries are data[:end].
+           None when there is no usable hint."""
+        try:
+            with open(self._hint_path(file_id), "rb") as hint_file:
+                data = hint_file.read()
+        except FileNotFoundError:
+            return None
 
-            op = record["op"]
-            key = record["key"]
+        if len(data) < HINT_TRAILER.size:
+            return None
 
-            if op == "put":
-                expiry = record.get("expiry", 0)
-                # Index keeps offsets to header & json lines
-                self.index[key] = (header_offset, json_offset, expiry)
+        # Hint must be intact and describe the data file as it is now on disk
+        end = len(data) - HINT_TRAILER.size
+        data_size, checksum = HINT_TRAILER.unpack_from(data, end)
+        if zlib.crc32(data[:end], zlib.crc32(struct.pack(">Q", data_size))) != checksum:
+            return None
+        if data_size != os.path.getsize(self._data_path(file_id)):
+            return None
 
-            elif op == "delete":
-                # Delete markers remove keys from index (Bitcask tombstones)
-                self.index.pop(key, None)
+        return data, end
 
+    @staticmethod
+    def _hint_entries(data, end):
+        """Parse hint-format entries from data[:end] as
+           (header_offset, key, key_size, value_size, expiry, flags)."""
+        pos = 0
+        while pos < end:
+            header_offset, value_size, expiry, key_size, flags = HINT.unpack_from(data, pos)
+            pos += HINT.size
+            key = data[pos:pos + key_size].decode()
+            pos += key_size
+            yield header_offset, key, key_size, value_size, expiry, flags
 
 
     # ----------------------------------------------------------------
-    # COMPACTION — rewrite only the latest versions of keys
+    # CHECKPOINT — snapshot of the index and the log position it covers
     # ----------------------------------------------------------------
-    def compact(self):
-        """Rewrite the log file keeping only live (latest) records.
-           Avoids log file growing forever. Works on Windows CRLF safely."""
-        
-        temp_filename = self.filename + ".compact"
-        temp_file = open(temp_filename, "w", buffering=1)
+    def checkpoint(self):
+        """Persist the index so startup only replays records appended after this point."""
+        with self.write_lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        if not self.ready.is_set() or self.load_aborted:
+            return  # a partially loaded index must never become the starting point
+
+        # Caller holds write_lock, so every appended record is already in the index.
+        # marshal is the fastest stdlib codec for a dict of str -> tuple of ints.
+        # Its format is tied to the Python version; an unreadable checkpoint is simply ignored.
+        if self.keydir == KEYDIR_COMPACT:
+            index = self.index.dump()
+        elif self.keydir == KEYDIR_DISK:
+            index = self.index.sync((self.active_id, self.write_file.tell()))  # pages stay in the keydir file
+        else:
+            index = self.index
+        payload = marshal.dumps(
+            (CHECKPOINT_VERSION, self.active_id, self.write_file.tell(),
+             bytes(self.active_hints), self.keydir, index)
+        )
+
+        temp_filename = self.checkpoint_path + ".tmp"
+        with open(temp_filename, "wb") as checkpoint_file:
+            checkpoint_file.write(struct.pack(">I", zlib.crc32(payload)))
+            checkpoint_file.write(payload)
+        os.replace(temp_filename, self.checkpoint_path)
+
+        self.bytes_since_checkpoint = 0
+        self.last_checkpoint_size = len(payload)
+
+    def _load_checkpoint(self):
+        """Return (file_id, offset, active_hints, index) from a usable checkpoint, else None."""
+        try:
+            with open(self.checkpoint_path, "rb") as checkpoint_file:
+                data = checkpoint_file.read()
+        except FileNotFoundError:
+            return None
 
-        for key, (header_offset, json_offset, expiry) in self.index.items():
-            
-            # Skip expired keys
-            if expiry != 0 and time.time() > expiry:
-                continue
+        if len(data) < 4 or zlib.crc32(data[4:]) != struct.unpack_from(">I", data)[0]:
+            return None
 
-            # Seek to the original header
-            self.read_file.seek(header_offset)
-            header = self.read_file.readline()  # Not used except to skip
+        try:
+            version, file_id, offset, active_hints, keydir, index = marshal.loads(data[4:])
+        except (EOFError, ValueError, TypeError):
+            return None
 
-            # Read the JSON line fully (CRLF safe); do NOT use read(length)!
-            json_line = self.read_file.readline().rstrip("\r\n")
+        # A checkpoint of the other index implementation is ignored (hints + replay rebuild it)
+        if version != CHECKPOINT_VERSION or keydir != self.keydir:
+            return None
+        if keydir == KEYDIR_COMPACT:
+            index = CompactKeydir.load(HEADER.size, index)
 
-            # Recompute fresh length & checksum for compacted file
-            length = len(json_line)
-            checksum = zlib.crc32(json_line.encode())
+        # The data file it points into must still hold at least `offset` bytes
+        if file_id not in self.file_ids or os.path.getsize(self._data_path(file_id)) < offset:
+            return None
 
-            # Write clean, compacted entry
-            temp_file.write(f"{length} {checksum}\n")
-            temp_file.write(json_line + "\n")
+        if keydir == KEYDIR_DISK:
+            # Only usable if the keydir file was last synced by this very checkpoint
+            index = DiskKeydir.reopen(self.keydir_path, HEADER.size, index, (file_id, offset))
+            if index is None:
+                return None
 
-        temp_file.close()
-        self.read_file.close()
-        self.write_file.close()
+        return file_id, offset, active_hints, index
 
-        # Atomically replace old file (safe even if crash happens)
-        os.replace(temp_filename, self.filename)
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
 
-        # Reopen fresh log and reload index from the compacted file
-        self.write_file = open(self.filename, "a+", buffering=1)
-        self.read_file = open(self.filename, "r", buffering=1)
-        self._load_index()
 
-        self.last_compaction_time = time.time()
+    # ----------------------------------------------------------------
+    # INDEX LOADING — Replay the log files at startup to rebuild index
+    # ----------------------------------------------------------------
+    def _new_index(self):
+        """Empty index of the configured keydir implementation (all share the dict API)."""
+        if self.keydir == KEYDIR_COMPACT:
+            return CompactKeydir(HEADER.size)
+        if self.keydir == KEYDIR_DISK:
+            return DiskKeydir(self.keydir_path, HEADER.size)
+        return {}
+
+    def _load_index(self):
+        """Rebuild the in-memory index: start from the checkpoint (if any), then
+           scan every data file written after it (oldest first).
+           This acts as crash recovery because we replay the log."""
+        start_id, start_offset = 0, 0
+
+        checkpoint = self._load_checkpoint()
+        if checkpoint is not None:
+            start_id, start_offset, active_hints, self.index = checkpoint
+            if start_id == self.active_id:
+                self.active_hints = bytearray(active_hints)
+        else:
+            self.index = self._new_index()
+
+        # Data files without a hint (and the active file) are scanned in worker processes
+        # up front; their results are still applied to the index strictly in log order
+        scans = self._start_parallel_scans(start_id, start_offset)
+
+        damaged = False
+        for file_id in self.file_ids:
+            if file_id < start_id:
+                continue  # fully covered by the checkpoint
+
+            # Sealed files load from their hint file when one is available
+            if file_id != self.active_id and self._load_hint(file_id):
+                continue
+
+            offset = start_offset if file_id == start_id else 0
+            if file_id in scans:
+                valid_end = self._merge_scans(file_id, offset, scans[file_id])
+            else:
+                valid_end = self._replay_file(file_id, offset)
+
+            # Drop a torn tail of the active file so new appends are not hidden behind it.
+            # Damage with intact records after it stays on disk (the active file is sealed).
+            if valid_end < os.path.getsize(self._data_path(file_id)):
+                if not self._torn_tail(file_id, valid_end):
+                    self._keep_damaged(file_id)
+                    damaged = file_id == self.active_id
+                elif file_id == self.active_id:
+                    self.write_file.truncate(valid_end)
+                    self.write_file.seek(valid_end)
+
+        if damaged:
+            self._rollover()  # its hint lists what was indexed, so restarts agree with this one
+
+        self._count_live_bytes()
+
+    def _start_parallel_scans(self, start_id, start_offset):
+        """Submit byte ranges of every data file that must be scanned to a process pool.
+           Returns {file_id: [(future, range stop), ...]}, empty when a serial replay is cheaper."""
+        ranges = []
+        for file_id in self.file_ids:
+            if file_id < start_id:
+                continue
+            if file_id != self.active_id and os.path.exists(self._hint_path(file_id)):
+                continue  # loads from its hint (a bad hint falls back to a serial replay)
+
+            offset = start_offset if file_id == start_id else 0
+            size = os.path.getsize(self._data_path(file_id))
+            for start in range(offset, size, LOAD_RANGE_BYTES):
+                ranges.append((file_id, start, min(start + LOAD_RANGE_BYTES, size)))
+
+        total = sum(stop - start for _, start, stop in ranges)
+        if self.load_workers < 2 or total < PARALLEL_LOAD_MIN_BYTES:
+            return {}
+        try:
+            # fork: workers must not re-run the importing program (spawn would)
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            return {}
+
+        scans = {}
+        with ProcessPoolExecutor(min(self.load_workers, len(ranges)), mp_context=context) as pool:
+            for file_id, start, stop in ranges:
+                future = pool.submit(scan_range, self._data_path(file_id), file_id, start, stop,
+                                     file_id == self.active_id)
+                scans.setdefault(file_id, []).append((future, stop))
+        return scans
+
+    def _merge_scans(self, file_id, offset, scans):
+        """Apply the worker results of one data file in order, stitching ranges together
+           at record boundaries. Returns the offset where the valid data ends."""
+        valid_end = offset
+        index = self.index
+        for future, stop in scans:
+            first, end, puts, deletes, entries = future.result()
+            if valid_end >= stop:
+                continue  # range lies inside a record the previous range already covered
+
+            if first != valid_end:
+                # Resynchronized inside a record (e.g. onto an inner record of a WriteBatch
+                # frame): the worker's view of this range is off, replay it here instead
+                end = self._replay_file(file_id, valid_end, stop)
+            else:
+                # Each range is a net effect, so applying ranges in order is applying the log
+                for key in deletes:
+                    index.pop(key, None)
+                if isinstance(index, dict):
+                    index.update(puts)
+                else:
+                    for key, entry in puts.items():
+                        index[key] = entry
+                if file_id == self.active_id:
+                    self.active_hints += entries
+
+            valid_end = end
+            if end < stop:
+                break  # torn or corrupted record: nothing after it is valid
+
+        return valid_end
+
+    def _replay_file(self, file_id, offset=0, stop=None):
+        """Apply every valid record of one data file starting in [offset, stop) to the index
+           (to its end by default). Returns the offset where the valid data ends."""
+        valid_end = offset
+        hints = self.active_hints if file_id == self.active_id else None
+        index = self.index
+        header_size = HEADER.size
+
+        # Same logic as _index_record, inlined: this loop runs once per record at startup
+        for header_offset, key, key_size, value_size, expiry, flags, valid_end in self._scan_records(file_id, offset, stop):
+            if flags & FLAG_TOMBSTONE:
+                index.pop(key, None)
+            else:
+                value_offset = header_offset + header_size + key_size
+                index[key] = (file_id, header_offset, value_offset, value_size, expiry)
+
+            if hints is not None:
+                hints += HINT.pack(header_offset, value_size, expiry, key_size, flags)
+                hints += key.encode()
+
+        return valid_end
+
+    def _scan_records(self, file_id, offset=0, stop=None):
+        """Walk a data file (records starting in [offset, stop), to its end by default) through
+           a read-only mmap, yielding every intact record as
+           (header_offset, key, key_size, value_size, expiry, flags, record_end).
+           Only keys are copied out and decoded; record_end is where the enclosing record
+           (a WriteBatch frame for batched records) stops."""
+        with open(self._data_path(file_id), "rb") as read_file:
+            size = os.fstat(read_file.fileno()).st_size
+            if size <= offset:
+                return
+
+            with mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ) as buf, memoryview(buf) as view:
+                header_size = HEADER.size
+                for _, end, header_offset, key_size, value_size, expiry, flags in iter_records(view, offset, size if stop is None else stop, size):
+                    key = buf[header_offset + header_size:header_offset + header_size + key_size].decode()
+                    yield header_offset, key, key_size, value_size, expiry, flags, end
+
+    def _index_record(self, file_id, header_offset, key, key_size, value_size, expiry, flags):
+        """Apply one replayed record (from a data or hint file) to the index."""
+        if flags & FLAG_TOMBSTONE:
+            # Delete markers remove keys from index (Bitcask tombstones)
+            self.index.pop(key, None)
+        else:
+            # Index keeps the data file plus offsets to the record header & raw value bytes
+            value_offset = header_offset + HEADER.size + key_size
+            self.index[key] = (file_id, header_offset, value_offset, value_size, expiry)
 
 
 
     # ----------------------------------------------------------------
-    # PUT — append new value to log
+    # LAZY LOADING — serve traffic while the index is built in the background
     # ----------------------------------------------------------------
-    def put(self, key, value, ttl=None):
-        # TTL stored as absolute expiry timestamp
-        expiry = int(time.time()) + ttl if ttl else 0
-        value = str(value)
+    def _start_lazy_load(self):
+        """Take new writes at once (in a fresh active file unless the log was closed cleanly)
+           and build the index newest-first on a background thread.
+
+           Newest-first means the first record met for a key is its final state, so a key the
+           loader met (or that was written since startup) can be answered at once: its index
+           entry is newer than the starting point, or it is in `deleted`. GETs for other keys
+           wait for `ready`."""
+        active_hint = None
+        if self.write_file.tell() > 0:
+            active_hint = self._read_hint_data(self.active_id)
+            if active_hint is not None:
+                # close() left a hint matching the file, so it ends on a record boundary:
+                # keep appending to it (the hint stops matching with the first append)
+                self.active_hints = bytearray(active_hint[0][:active_hint[1]])
+            else:
+                # The old active file may end in a torn record; nothing appends to it any
+                # more, so the loader can truncate it safely
+                self.torn_id = self.active_id
+                self.write_file.close()
+                self.active_id += 1
+                self.file_ids.append(self.active_id)
+                self.write_file = open(self._data_path(self.active_id), "ab")
+        self.file_sizes[self.active_id] = self.write_file.tell()
+        # The active file only holds records to load when it was reused
+        load_ids = self.file_ids[:] if active_hint is not None else self.file_ids[:-1]
+
+        checkpoint = None
+        if self.keydir == KEYDIR_DISK:
+            # Only the page directory is read here (cheap); the pages are the live index
+            checkpoint = self._load_checkpoint()
+        self.index = checkpoint[3] if checkpoint else self._new_index()
+        if checkpoint:
+            self.load_floor = (checkpoint[0], checkpoint[1])  # older entries are the checkpoint's
+        self.deleted = set()
+
+        self.load_thread = threading.Thread(
+            target=self._lazy_load, args=(load_ids, checkpoint, active_hint), daemon=True)
+        self.load_thread.start()
+
+    def _lazy_load(self, file_ids, checkpoint, active_hint):
+        if checkpoint is None and self.keydir != KEYDIR_DISK:
+            checkpoint = self._load_checkpoint()
+        start_id, start_offset, active_hints, base = checkpoint or (0, 0, b"", None)
+        if self.keydir == KEYDIR_DISK:
+            base = None  # already serving as self.index
+
+        file_ids = [f for f in file_ids if f >= start_id]
+        sizes = {f: os.path.getsize(self._data_path(f)) for f in file_ids}
+        total = sum(sizes.values()) - start_offset
+        done = 0
+
+        for file_id in reversed(file_ids):
+            if self.closed.is_set():
+                # close() while loading: wake the waiters, the partial index is never used
+                self.load_aborted = True
+                self.ready.set()
+                return
+
+            offset = start_offset if file_id == start_id else 0
+            if active_hint is not None and file_id == file_ids[-1]:
+                entries = list(self._hint_entries(*active_hint))  # the file grows meanwhile
+            else:
+                entries = None if file_id == self.torn_id else self._read_hint(file_id)
+            if entries is None:
+                entries = []
+                valid_end = offset
+                for header_offset, key, key_size, value_size, expiry, flags, valid_end in self._scan_records(file_id, offset):
+                    entries.append((header_offset, key, key_size, value_size, expiry, flags))
+                if file_id == self.torn_id:
+                    self._seal_torn_file(file_id, valid_end, active_hints if file_id == start_id else b"", entries)
+
+            for header_offset, key, key_size, value_size, expiry, flags in reversed(entries):
+                if header_offset < offset:
+                    break  # the checkpoint covers the rest of this file
+                with self._stripe(key):
+                    if self._decided(key):
+                        continue  # a newer record (or a write since startup) already decided it
+                    if flags & FLAG_TOMBSTONE:
+                        self.deleted.add(key)
+                    self._index_record(file_id, header_offset, key, key_size, value_size, expiry, flags)
+
+            done += sizes[file_id] - offset
+            self.load_progress = done / total if total else 1.0
+
+        with self._exclusive():
+            if base is not None:
+                # The checkpoint is the oldest layer: everything decided since overrides it
+                for key in self.deleted:
+                    base.pop(key, None)
+                for key, entry in self.index.items():
+                    base[key] = entry  # deleted and written again since
+                self.index = base
+            self.deleted = None
+
+            # Exclusive: GETs pop expired keys (and uncount them) under their stripe lock
+            self._count_live_bytes()
+        self.load_progress = 1.0
+        self.ready.set()
+
+        if self.sorted_keys is not None:
+            self.sorted_keys.reset(self.index.keys())  # keys written meanwhile stay pending
+
+        for file_id in list(self.file_ids):
+            self._check_dead_ratio(file_id)
+
+    def _decided(self, key):
+        """lazy_load: True if the final state of `key` is known already. Caller holds its
+           stripe lock."""
+        if self.deleted is None:
+            return True  # loading finished
+        entry = self.index.get(key)
+        if entry is None:
+            return key in self.deleted
+        return (entry[0], entry[1]) >= self.load_floor
+
+    def _wait_until_decided(self, key):
+        """lazy_load: block until `key` can be answered (at worst until loading finishes)."""
+        if self.deleted is not None:
+            with self._stripe(key):
+                decided = self._decided(key)
+            if not decided:
+                self._wait_ready()
+
+    def _wait_ready(self):
+        """Block until the index covers the whole log (lazy_load). Raises ValueError if
+           close() stopped the load first: a partial index cannot answer anything."""
+        self.ready.wait()
+        if self.load_aborted:
+            raise ValueError("store was closed before its index finished loading")
+
+    def _seal_torn_file(self, file_id, valid_end, hints, entries):
+        """Cut a torn tail off the file that was active at startup (or keep a damaged one
+           aside, see _load_index) and give it a hint."""
+        if valid_end < os.path.getsize(self._data_path(file_id)):
+            if self._torn_tail(file_id, valid_end):
+                os.truncate(self._data_path(file_id), valid_end)
+            else:
+                self._keep_damaged(file_id)
+
+        hints = bytearray(hints)  # entries before the checkpoint offset, if any
+        for header_offset, key, key_size, value_size, expiry, flags in entries:
+            hints += HINT.pack(header_offset, value_size, expiry, key_size, flags)
+            hints += key.encode()
+        self._write_hint(file_id, hints)
 
-        # Record is stored as JSON in the log
-        record = {"op": "put", "key": key, "value": value, "expiry": expiry}
 
-        json_data = json.dumps(record)
-        length = len(json_data)
-        checksum = zlib.crc32(json_data.encode())
+    # ----------------------------------------------------------------
+    # COMPACTION — rewrite each immutable file with only its live records
+    # ----------------------------------------------------------------
+    def compact(self, wait=True):
+        """Seal the active file, then rewrite every data file keeping only live (latest) records.
+           Files are compacted one at a time while puts and gets keep running; each rewritten
+           file is swapped in under a short exclusive lock.
+           wait=False runs it on a background thread and returns immediately.
+           Returns False if a compaction is already running."""
+        if not self.compaction_lock.acquire(blocking=wait):
+            return False
+
+        if wait:
+            try:
+                self._run_compaction()
+            finally:
+                self.compaction_lock.release()
+        else:
+            thread = threading.Thread(target=self._compaction_worker, daemon=True)
+            thread.start()
+            self.compaction_thread = thread
+        return True
+
+    def _compaction_worker(self, candidates_only=False):
+        try:
+            if candidates_only:
+                self._compact_candidates()
+            else:
+                self._run_compaction()
+        finally:
+            self.compaction_lock.release()
+
+        # A file may have crossed the threshold after the last look at the queue
+        if self.compaction_candidates:
+            self._schedule_compaction()
+
+    def _run_compaction(self):
+        self.ready.wait()  # compaction needs the whole index
+        if self.load_aborted:
+            return  # closed before it was loaded
+
+        with self.write_lock:
+            if self.write_file.tell() > 0:
+                self._rollover()
+            targets = self.file_ids[:-1]
+            self.compaction_candidates.difference_update(targets)
+
+        self._compact_files(targets)
+
+    def _compact_candidates(self):
+        """Compact only the sealed files whose dead ratio crossed the threshold."""
+        while not self.closed.is_set():
+            with self.write_lock:
+                targets = sorted(f for f in self.compaction_candidates if f in self.file_ids)
+                self.compaction_candidates.clear()
+            if not targets:
+                break
+            self._compact_files(targets)
+
+    def _compact_files(self, targets):
+        # Oldest first: stale records in older files disappear before the
+        # tombstones that shadow them in newer files
+        done = set()
+        for file_id in targets:
+            # A tombstone (or an expired value) may only be dropped once every older file was
+            # compacted in this run; otherwise an older record of the same key would come
+            # back on the next replay
+            drop_tombstones = all(f in done for f in list(self.file_ids) if f < file_id)
+            self._compact_file(file_id, drop_tombstones)
+            done.add(file_id)
+
+        self.checkpoint()
+        self.last_compaction_time = time.time()
 
-        # Current write pointer = header position
-        header_offset = self.write_file.tell()
+    def _compact_file(self, file_id, drop_tombstones=True):
+        """Rewrite one immutable data file and repoint the index entries that still use it."""
+        temp_filename = self._data_path(file_id) + ".compact"
+        temp_fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        fd = self._reader(file_id)
+        hints = bytearray()
+        moved = []    # (key, old entry, new entry)
+        expired = []  # (key, old entry)
+        shadowed = set()  # keys with a delete marker in the rewritten file
+
+        # The hint lists every record (without values), so liveness is decided without
+        # reading the file at all; without a usable hint, stream the file front to back.
+        # The file is immutable, so entries can only move away from it while we copy.
+        records = self._read_hint(file_id)
+        if records is None:
+            records = (record[:6] for record in self._scan_records(file_id))
+
+        # Records are copied unchanged (checksums stay valid), so contiguous kept records
+        # are copied as one run, kernel-side, and only their offsets are rewritten
+        new_size = 0
+        run_start = run_end = 0  # source byte range of the run not copied yet
+        for header_offset, key, key_size, value_size, expiry, flags in records:
+            entry = self.index.get(key)
+            live = entry is not None and entry[0] == file_id and entry[1] == header_offset
+            has_expired = expiry != 0 and time.time() > expiry
+            if live and has_expired:
+                expired.append((key, entry))  # Skip expired keys
+
+            if not live or has_expired:
+                # Not kept as it is. Unless every older file was compacted in this run, an
+                # older put of a key that is gone may still be on disk: keep delete markers,
+                # and leave one in place of an expired value (whether the index still points
+                # at it or a GET already dropped it) so that put stays shadowed on replay
+                if drop_tombstones or (entry is not None and not live):
+                    continue
+                if not flags & FLAG_TOMBSTONE:
+                    if not has_expired or key in shadowed:
+                        continue
+                    new_size += self._copy_range(fd, temp_fd, run_start, run_end - run_start)
+                    tombstone = encode_record(key.encode(), b"", flags=FLAG_TOMBSTONE)
+                    hints += HINT.pack(new_size, 0, 0, key_size, FLAG_TOMBSTONE)
+                    hints += key.encode()
+                    new_size += self._write_all(temp_fd, tombstone)
+                    shadowed.add(key)
+                    run_start = run_end = header_offset + HEADER.size + key_size + value_size
+                    continue
+                shadowed.add(key)
+
+            if header_offset != run_end:
+                new_size += self._copy_range(fd, temp_fd, run_start, run_end - run_start)
+                run_start = header_offset
+            run_end = header_offset + HEADER.size + key_size + value_size
+
+            new_offset = new_size + (header_offset - run_start)
+            hints += HINT.pack(new_offset, value_size, expiry, key_size, flags)
+            hints += key.encode()
+            if entry is not None:
+                new_entry = (file_id, new_offset, new_offset + HEADER.size + key_size, value_size, expiry)
+                moved.append((key, entry, new_entry))
+
+        new_size += self._copy_range(fd, temp_fd, run_start, run_end - run_start)
+        if self.fsync != FSYNC_NONE:
+            os.fsync(temp_fd)
+        os.close(temp_fd)
+
+        # Swap: nothing may read the old file or checkpoint its offsets from here on
+        with self._exclusive():
+            # Offsets are about to change; a stale checkpoint must never be loaded
+            self._remove_checkpoint()
+
+            # Old hint no longer matches; without one a crash here just means a replay
+            if os.path.exists(self._hint_path(file_id)):
+                os.remove(self._hint_path(file_id))
+
+            if new_size:
+                # Atomically replace old file (safe even if crash happens)
+                os.replace(temp_filename, self._data_path(file_id))
+                self.file_sizes[file_id] = new_size
+            else:
+                # Nothing live left → drop the file entirely
+                os.remove(temp_filename)
+                os.remove(self._data_path(file_id))
+                self.file_ids.remove(file_id)
+
+            if file_id in self.fds:
+                os.close(self.fds.pop(file_id))
+            self.verified_hints.pop(file_id, None)
+            if file_id in self.mmaps:
+                self.mmaps.pop(file_id).close()  # no reader holds it: we own every stripe
+
+            self.files_rewritten += 1
+
+            # Only repoint entries nobody overwrote or deleted while we were copying
+            for key, old_entry, new_entry in moved:
+                if self.index.get(key) == old_entry:
+                    self.index[key] = new_entry
+            for key, old_entry in expired:
+                if self.index.get(key) == old_entry:
+                    self.index.pop(key)  # expired entries are gone from the rewritten file
+                    self.cache.delete(key)
+                    self._drop_live(old_entry)
+
+            if not new_size:
+                self._forget_file_space(file_id)
+
+        if new_size:
+            self._write_hint(file_id, hints)
+
+    @staticmethod
+    def _write_all(fd, data):
+        """os.write until all of `data` is written. Returns its length."""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        return len(data)
+
+    @staticmethod
+    def _copy_range(src_fd, dst_fd, offset, length):
+        """Append `length` bytes of src (starting at `offset`) to dst without pulling them
+           through Python where the OS allows it. Returns the number of bytes copied."""
+        copied = 0
+        while copied < length:
+            count = length - copied
+            try:
+                n = os.copy_file_range(src_fd, dst_fd, count, offset + copied)
+            except (AttributeError, OSError):
+                try:
+                    n = os.sendfile(dst_fd, src_fd, offset + copied, count)
+                except (AttributeError, OSError):
+                    # No kernel-side copy here (platform or filesystem): plain read + write
+                    n = os.write(dst_fd, os.pread(src_fd, min(count, SCAN_BUFFER_SIZE), offset + copied))
+            if n == 0:
+                raise IOError(f"data file ended early while compacting (offset {offset + copied})")
+            copied += n
+        return copied
 
-        # HEADER WRITE
-        self.write_file.write(f"{length} {checksum}\n")
 
-        # JSON WRITE
-        self.write_file.write(json_data + "\n")
-        self.write_file.flush()  # Ensure durability
 
-        # JSON offset = header_offset + header length
-        json_offset = header_offset + len(f"{length} {checksum}\n")
+    # ----------------------------------------------------------------
+    # PUT — append new value to log
+    # ----------------------------------------------------------------
+    def put(self, key, value, ttl=None):
+        # TTL stored as absolute expiry timestamp
+        expiry = expiry_for(ttl)
+        # bytes are stored as-is (read back with get(key, raw=True)); anything else as text
+        if isinstance(value, bytes):
+            data = value
+        else:
+            value = str(value)
+            data = value.encode()
 
-        # Update in-memory index
-        self.index[key] = (header_offset, json_offset, expiry)
+        record = encode_record(key.encode(), data, expiry)
 
-        self.cache.put(key, value)
-        self.put_count += 1
+        # RECORD WRITE (header + key + value in one call), then index + cache update
+        self._write(record, [(0, key, value)])
 
 
 
@@ -172,66 +1386,363 @@ class KVStore:
     # ----------------------------------------------------------------
     def delete(self, key):
         # Tombstone record (Bitcask-style delete)
-        record = {"op": "delete", "key": key}
+        record = encode_record(key.encode(), b"", flags=FLAG_TOMBSTONE)
+        self._write(record, [(0, key, None)])
 
-        json_data = json.dumps(record)
-        length = len(json_data)
-        checksum = zlib.crc32(json_data.encode())
 
-        header_offset = self.write_file.tell()
 
-        self.write_file.write(f"{length} {checksum}\n")
-        self.write_file.write(json_data + "\n")
-        self.write_file.flush()
+    # ----------------------------------------------------------------
+    # WRITE BATCH — many puts/deletes in one framed, all-or-nothing block
+    # ----------------------------------------------------------------
+    def write(self, batch):
+        """Commit a WriteBatch as one contiguous frame with a single checksum.
+           Recovery applies the whole frame or, if it was torn by a crash, none of it."""
+        if not batch.records:
+            return
 
-        # Remove from index & cache
-        self.index.pop(key, None)
-        self.cache.delete(key)
+        frame = encode_record(b"", b"".join(batch.records), flags=FLAG_BATCH)
 
-        self.delete_count += 1
+        # Inner records sit right after the frame header
+        ops = [(HEADER.size + offset, key, value) for offset, key, value in batch.ops]
+        self._write(frame, ops)
 
 
 
     # ----------------------------------------------------------------
     # GET — read latest value from disk (or cache)
     # ----------------------------------------------------------------
-    def get(self, key):
-        if key not in self.index:
-            return None
+    def get(self, key, raw=False):
+        """Latest value of `key` as text, or as the stored bytes with raw=True (for values
+           put as bytes, which need not be valid UTF-8: as text, those come back with
+           backslash escapes for the bytes that do not decode)."""
+        # lazy_load still running: a key it has not decided yet may live in an older file
+        self._wait_until_decided(key)
+
+        # Stripe lock keeps the index entry, the file it points at and the cache in step
+        with self._stripe(key):
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+
+            file_id, header_offset, value_offset, value_size, expiry = entry
+
+            # TTL check
+            if expiry != 0 and time.time() > expiry:
+                self.index.pop(key, None)
+                self.cache.delete(key)
+                self._drop_live(entry)
+                if self.deleted is not None:
+                    self.deleted.add(key)  # lazy_load: an older record must not come back
+                return None
+
+            # Cache hit → fastest path
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached.encode() if raw else cached
+
+            data = self._read_value(file_id, value_offset, value_size, raw=True)
+            if raw:
+                return data
+            try:
+                value = data.decode()
+            except UnicodeDecodeError:
+                # Not text: escaped, and never cached (raw reads must get the stored bytes)
+                return data.decode(errors="backslashreplace")
+
+            # Store in cache
+            self.cache.put(key, value)
+            return value
+
+    def _read_value(self, file_id, value_offset, value_size, raw=False):
+        """Read a value straight from its data file, as text unless `raw` (bytes that are
+           not UTF-8 as backslash escapes). Caller holds the key's stripe lock."""
+        # Index knows where the value starts and how long it is → no header re-read
+        if self.use_mmap:
+            # Value is a plain slice of the mapped file → no syscalls
+            mapped = self._mapped(file_id, value_offset + value_size)
+            value = mapped[value_offset:value_offset + value_size]
+        else:
+            # Positional read straight at the value offset (Bitcask principle);
+            # pread has no shared file position, so readers never race each other
+            value = os.pread(self._reader(file_id), value_size, value_offset)
+        return value if raw else value.decode(errors="backslashreplace")
+
+    def exists(self, key):
+        """True if `key` has a value that has not expired. Only the index is consulted."""
+        self._wait_until_decided(key)
+
+        with self._stripe(key):
+            entry = self.index.get(key)
+        if entry is None:
+            return False
+        expiry = entry[4]
+        return expiry == 0 or time.time() <= expiry
 
-        header_offset, json_offset, expiry = self.index[key]
 
-        # TTL check
-        if expiry != 0 and time.time() > expiry:
-            self.index.pop(key, None)
-            self.cache.delete(key)
-            return None
 
-        # Cache hit → fastest path
-        cached = self.cache.get(key)
-        if cached is not None:
-            return cached
+    # ----------------------------------------------------------------
+    # SCAN — keys in order, by range and/or prefix
+    # ----------------------------------------------------------------
+    def scan(self, start=None, end=None, prefix=None, limit=None):
+        """Yield (key, value) pairs in key order with start <= key < end, optionally only
+           keys beginning with `prefix`, at most `limit` of them. Values are read lazily.
+           Uses the ordered index (ordered=True); without it every call sorts all keys."""
+        self._wait_ready()  # lazy_load: the key set is only complete once loaded
+        sorted_keys = self.sorted_keys if self.sorted_keys is not None else SortedKeys(self.index.keys())
+
+        if prefix is not None and (start is None or start < prefix):
+            start = prefix
 
-        # Seek directly to the JSON offset (Bitcask principle)
-        self.read_file.seek(json_offset)
+        count = 0
+        for key in sorted_keys.range(start):
+            if limit is not None and count >= limit:
+                return
+            if end is not None and key >= end:
+                return
+            if prefix is not None and not key.startswith(prefix):
+                return  # sorted order: no later key has the prefix either
 
-        # Read JSON body using stored length from header
-        json_data = self.read_file.read(self._read_json_length(header_offset))
+            value = self.get(key)
+            if value is None:
+                continue  # deleted or expired since
+            yield key, value
+            count += 1
 
-        record = json.loads(json_data)
-        value = record["value"]
 
-        # Store in cache
-        self.cache.put(key, value)
-        return value
+
+    # ----------------------------------------------------------------
+    # ITERATION — every live key in on-disk order, resumable by cursor
+    # ----------------------------------------------------------------
+    def keys(self):
+        """Yield every live key, in on-disk order (no values are read)."""
+        for _, key, _ in self._iter_live():
+            yield key
+
+    def items(self, raw=False):
+        """Yield every live (key, value) pair in on-disk order, so values are read
+           sequentially, file by file. Bypasses the LRU cache. raw=True: values as bytes
+           (as text, like get(), bytes that are not UTF-8 come back escaped)."""
+        for position, key, _ in self._iter_live():
+            value = self._read_live(key, position[0], raw)
+            if value is not None:
+                yield key, value
+
+    def scan_cursor(self, cursor="0", count=10, raw=False):
+        """One page of a resumable iteration over items(): returns (next_cursor, pairs)
+           with up to `count` pairs. Start with cursor "0"; "0" is returned once done.
+           A cursor is "<file id>:<offset>[:<hint position>]" of the next record to look at,
+           so pages need no server-side state and each one resumes right where the last
+           stopped. Compacting the file a cursor points into may skip keys."""
+        start = (0, 0, 0) if cursor == "0" else self._parse_cursor(cursor)
+        pairs = []
+        for position, key, _ in self._iter_live(start):
+            if len(pairs) == count:
+                return self._cursor(position), pairs
+            value = self._read_live(key, position[0], raw)
+            if value is not None:
+                pairs.append((key, value))
+        return "0", pairs
+
+    def keys_cursor(self, cursor="0", count=10):
+        """scan_cursor() without the values: returns (next_cursor, keys). Pages read hint
+           entries only; expired keys are left out."""
+        start = (0, 0, 0) if cursor == "0" else self._parse_cursor(cursor)
+        keys = []
+        now = time.time()
+        for position, key, entry in self._iter_live(start):
+            if len(keys) == count:
+                return self._cursor(position), keys
+            expiry = entry[4]
+            if expiry == 0 or now <= expiry:
+                keys.append(key)
+        return "0", keys
+
+    @staticmethod
+    def _cursor(position):
+        return ":".join(str(part) for part in position if part is not None)
+
+    @staticmethod
+    def _parse_cursor(cursor):
+        parts = [int(part) for part in cursor.split(":")]
+        if len(parts) == 2:
+            parts.append(None)  # no hint position: read the file's hint from its start
+        file_id, offset, hint_pos = parts
+        return file_id, offset, hint_pos
+
+    def _iter_live(self, start=(0, 0, 0)):
+        """Yield ((file_id, header_offset, hint_pos), key, entry) for every record the index
+           still points at, in on-disk order from `start` on. Only hint entries are read."""
+        self._wait_ready()  # lazy_load: the index decides which records are live
+
+        start_id, start_offset, start_hint = start
+        file_id = start_id - 1
+        while True:
+            # Next file each time round, so files rolled over meanwhile are visited too
+            later = [f for f in list(self.file_ids) if f > file_id]
+            if not later:
+                return
+            file_id = later[0]
+
+            offset, hint_pos = (start_offset, start_hint) if file_id == start_id else (0, 0)
+            yielded = set()  # keys of this file already produced (only used after a rewrite)
+            while True:
+                rewrites = self.files_rewritten
+                rewritten = False
+                for position, key in self._file_records(file_id, offset, hint_pos):
+                    if self.files_rewritten != rewrites:
+                        rewritten = True  # compaction moved records around: read the file again
+                        break
+                    header_offset = position[1]
+                    if header_offset < offset or key in yielded:
+                        continue
+                    entry = self.index.get(key)
+                    if entry is not None and entry[0] == file_id and entry[1] == header_offset:
+                        yielded.add(key)
+                        yield position, key, entry
+                if not rewritten:
+                    break
+                offset, hint_pos = 0, 0  # offsets from before the rewrite mean nothing now
+
+    def _file_records(self, file_id, offset=0, hint_pos=0):
+        """((file_id, header_offset, hint_pos), key) of the records of one data file, in file
+           order, where hint_pos locates the record's entry in the file's hint (the in-memory
+           one for the active file). Starts at the hint entry `hint_pos` when it is the one of
+           the record at `offset`, else at the start of the hint; without a usable hint the
+           data file itself is walked from `offset` (hint_pos is then None). Empty if the
+           file is gone."""
+        with self.write_lock:
+            if file_id not in self.file_ids:
+                return
+            active = file_id == self.active_id
+        try:
+            hint = None if active else self._open_hint(file_id)
+            if not active and hint is None:
+                for header_offset, key, _, _, _, _, _ in self._scan_records(file_id, offset):
+                    yield (file_id, header_offset, None), key
+                return
+
+            records = self._hint_records(file_id, hint_pos or 0, hint)
+            first = next(records, None)
+            if first is not None and hint_pos and first[1] != offset:
+                # Stale position (the file was rewritten since the cursor was made)
+                records.close()
+                records = self._hint_records(file_id, 0, None if active else self._open_hint(file_id))
+                first = next(records, None)
+            if first is None:
+                return
+            yield (file_id, first[1], first[0]), first[2]
+            for pos, header_offset, key in records:
+                yield (file_id, header_offset, pos), key
+        except FileNotFoundError:
+            return  # removed by compaction meanwhile
+
+    def _open_hint(self, file_id):
+        """(fd, end of its entries) of a data file's hint if it is intact and describes the
+           file as it is on disk, else None. A misaligned entry would yield garbage keys, so
+           the checksum is checked too, but only once per hint file: pages resume often."""
+        try:
+            fd = os.open(self._hint_path(file_id), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            stat = os.fstat(fd)
+            end = stat.st_size - HINT_TRAILER.size
+            if end >= 0:
+                data_size, checksum = HINT_TRAILER.unpack(os.pread(fd, HINT_TRAILER.size, end))
+                identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                if (data_size == os.path.getsize(self._data_path(file_id))
+                        and (self.verified_hints.get(file_id) == identity
+                             or self._hint_checksum(fd, end, data_size) == checksum)):
+                    self.verified_hints[file_id] = identity
+                    return fd, end
+        except FileNotFoundError:
+            pass  # data file removed by compaction meanwhile
+        os.close(fd)
+        return None
+
+    @staticmethod
+    def _hint_checksum(fd, end, data_size):
+        """Checksum of the entries of an open hint file, as its trailer stores it."""
+        checksum = zlib.crc32(struct.pack(">Q", data_size))
+        pos = 0
+        while pos < end:
+            chunk = os.pread(fd, min(HINT_CHUNK, end - pos), pos)
+            if not chunk:
+                return None
+            checksum = zlib.crc32(chunk, checksum)
+            pos += len(chunk)
+        return checksum
+
+    def _hint_records(self, file_id, pos, hint=None):
+        """(hint_pos, header_offset, key) of a data file's hint entries from position `pos`
+           on, read HINT_CHUNK bytes at a time: from the in-memory hint while the file is
+           active, from its hint file (`hint`, as opened by _open_hint) once sealed."""
+        try:
+            while True:
+                chunk = None
+                if hint is None:
+                    with self.write_lock:
+                        if file_id == self.active_id:
+                            chunk = bytes(self.active_hints[pos:pos + HINT_CHUNK])
+                    if chunk is None:
+                        hint = self._open_hint(file_id)  # rolled over meanwhile
+                        if hint is None:
+                            return
+                if chunk is None:
+                    fd, end = hint
+                    chunk = os.pread(fd, min(HINT_CHUNK, end - pos), pos) if pos < end else b""
+
+                used = 0
+                while used + HINT.size <= len(chunk):
+                    header_offset, _, _, key_size, _ = HINT.unpack_from(chunk, used)
+                    key_end = used + HINT.size + key_size
+                    if key_end > len(chunk):
+                        break  # continues in the next chunk
+                    yield pos + used, header_offset, chunk[used + HINT.size:key_end].decode()
+                    used = key_end
+                if not used:
+                    return  # end of the entries
+                pos += used
+        finally:
+            if hint is not None:
+                os.close(hint[0])
+
+    def _read_live(self, key, file_id, raw=False):
+        """Value of `key` if it still lives in data file `file_id` (and has not expired).
+           Compaction may have moved it within the file meanwhile; a newer version in the
+           same (active) file is fine too — _iter_live never yields a key twice per file."""
+        with self._stripe(key):
+            entry = self.index.get(key)
+            if entry is None or entry[0] != file_id:
+                return None  # deleted, or overwritten in a later file (iterated later)
+            _, _, value_offset, value_size, expiry = entry
+            if expiry != 0 and time.time() > expiry:
+                return None
+            return self._read_value(file_id, value_offset, value_size, raw)
+
 
 
-    def _read_json_length(self, header_offset):
-        """Helper: read header to get JSON length."""
-        self.read_file.seek(header_offset)
-        header = self.read_file.readline().strip()
-        length, _ = map(int, header.split())
-        return length
+    # ----------------------------------------------------------------
+    # STATS
+    # ----------------------------------------------------------------
+    def stats(self):
+        """Return basic counters about the store."""
+        self._sweep_expired()
+        with self.space_lock:
+            keys_with_ttl = sum(self.ttl_keys.values())
+        return {
+            "keys_in_index": len(self.index),
+            "keys_in_cache": len(self.cache.cache),
+            "put_count": self.put_count,
+            "delete_count": self.delete_count,
+            "data_files": len(self.file_ids),
+            "file_size_bytes": sum(self.file_sizes.values()),
+            "dead_bytes": (sum(self.file_sizes.values()) - sum(self.live_bytes.values())
+                           + sum(self.expired_bytes.values())),
+            "keys_with_ttl": keys_with_ttl,
+            "last_compaction_time": self.last_compaction_time,
+            "index_load_progress": round(self.load_progress, 3),
+        }
 
 
 
@@ -239,11 +1750,39 @@ class KVStore:
     # CLEANUP
     # ----------------------------------------------------------------
     def close(self):
-        """Safely close file handles."""
+        """Checkpoint the index and safely close file handles."""
+        self._close(checkpoint=True)
+
+    def _close(self, checkpoint):
+        self.closed.set()  # stops the everysec flusher and a lazy index load
+        if self.load_thread is not None:
+            self.load_thread.join()
+        if self.compaction_thread is not None:
+            self.compaction_thread.join()
         if not self.write_file.closed:
-            self.write_file.close()
-        if not self.read_file.closed:
-            self.read_file.close()
+            # keydir="disk" is only reusable at startup right after a checkpoint
+            if checkpoint and (self.bytes_since_checkpoint or self.keydir == KEYDIR_DISK):
+                self.checkpoint()
+            with self.write_lock:
+                if self.fsync != FSYNC_NONE:
+                    self.write_file.flush()
+                    os.fsync(self.write_file.fileno())
+                if checkpoint and self.write_file.tell() > 0:
+                    # Marks the active file as ending on a record boundary: a lazy_load
+                    # restart keeps appending to it instead of sealing it
+                    self._write_hint(self.active_id, self.active_hints)
+                self.write_file.close()
+        for mapped in self.mmaps.values():
+            mapped.close()
+        self.mmaps.clear()
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+        if self.keydir == KEYDIR_DISK and not self.index.file.closed:
+            self.index.close()
 
     def __del__(self):
-        self.close()
+        # No checkpoint here: at interpreter exit builtins like open() may already be gone.
+        # A store that was never closed just replays its log tail on the next start.
+        if hasattr(self, "write_file"):  # __init__ may have failed before opening files
+            self._close(checkpoint=False)
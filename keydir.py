@@ -0,0 +1,610 @@
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+from lru_cache import LRUCache
+
+EMPTY = 0  # slot value for "no entry"; occupied slots hold entry number + 1
+_MISSING = object()
+
+# DiskKeydir file layout: a header page, then bucket pages of PAGE_SIZE bytes.
+# header: magic | clean flag | token (checkpoint position it matches: file id, offset)
+# page:   entry count | used bytes | local depth | entries
+# entry:  key_size | file_id | header_offset | value_size | expiry | key
+PAGE_SIZE = 4096
+DISK_MAGIC = b"BPKD"
+DISK_HEADER = struct.Struct(">4sBQQ")
+PAGE_HEADER = struct.Struct(">HHB")
+DISK_ENTRY = struct.Struct(">HIQII")
+DEFAULT_HOT_KEYS = 100_000  # entries DiskKeydir keeps in RAM
+
+
+class CompactKeydir:
+    """Drop-in replacement for the dict index (key -> (file_id, header_offset, value_offset,
+       value_size, expiry)) for stores with tens of millions of keys.
+
+       Entries are kept densely in typed arrays, one column per field, with all key bytes
+       packed into a single bytearray arena. An open-addressing slot table (linear probing)
+       maps key hashes to entry numbers. That is ~40 bytes per key plus the key itself,
+       instead of the 150+ bytes of a dict entry, a tuple and its ints."""
+
+    def __init__(self, header_size, capacity=8):
+        # value_offset is not stored: it is always header_offset + header_size + key length
+        self.header_size = header_size
+        # Lookups probe over several arrays, so even GETs must not interleave with a PUT
+        self.lock = threading.Lock()
+        self._reset(capacity)
+
+    def _reset(self, capacity):
+        self.slots = array("I", bytes(4 * capacity))  # capacity is always a power of two
+        self.mask = capacity - 1
+        self.hashes = array("q")
+        self.key_starts = array("Q")
+        self.key_sizes = array("H")
+        self.file_ids = array("I")
+        self.header_offsets = array("Q")
+        self.value_sizes = array("I")
+        self.expiries = array("I")
+        self.arena = bytearray()
+        self.garbage = 0  # arena bytes of removed keys
+
+    # ----------------------------------------------------------------
+    # Dict API (only what KVStore uses)
+    # ----------------------------------------------------------------
+    def get(self, key, default=None):
+        with self.lock:
+            _, entry = self._lookup(key.encode(), hash(key))
+            return default if entry < 0 else self._entry(entry)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        file_id, header_offset, _, value_size, expiry = value
+        key_bytes = key.encode()
+        key_hash = hash(key)
+
+        with self.lock:
+            slot, entry = self._lookup(key_bytes, key_hash)
+            if entry >= 0:
+                self.file_ids[entry] = file_id
+                self.header_offsets[entry] = header_offset
+                self.value_sizes[entry] = value_size
+                self.expiries[entry] = expiry
+                return
+
+            self.slots[slot] = len(self.hashes) + 1
+            self._append(key_hash, key_bytes, file_id, header_offset, value_size, expiry)
+
+            # Keep the table at most 2/3 full so probe chains stay short
+            if len(self.hashes) * 3 >= len(self.slots) * 2:
+                self._rehash(len(self.slots) * 2)
+
+    def pop(self, key, default=_MISSING):
+        with self.lock:
+            slot, entry = self._lookup(key.encode(), hash(key))
+            if entry < 0:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+
+            value = self._entry(entry)
+            self._remove(slot, entry)
+            return value
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def items(self):
+        """Iterate over (key, entry) pairs of a snapshot (the table may change meanwhile)."""
+        with self.lock:
+            # Column copies are single C-level memcpys; the Python work happens outside the lock
+            arena = bytes(self.arena)
+            columns = (self.key_starts[:], self.key_sizes[:], self.file_ids[:],
+                       self.header_offsets[:], self.value_sizes[:], self.expiries[:])
+
+        header_size = self.header_size
+        for start, key_size, file_id, header_offset, value_size, expiry in zip(*columns):
+            key = arena[start:start + key_size].decode()
+            yield key, (file_id, header_offset, header_offset + header_size + key_size, value_size, expiry)
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    # ----------------------------------------------------------------
+    # Checkpoint support — hashes are per-process, so only the entries are saved
+    # ----------------------------------------------------------------
+    def dump(self):
+        """Entries as a tuple of bytes objects (marshal-friendly)."""
+        with self.lock:
+            self._compact_arena()
+            return (bytes(self.arena),) + tuple(
+                column.tobytes() for column in (self.key_starts, self.key_sizes, self.file_ids,
+                                                self.header_offsets, self.value_sizes, self.expiries))
+
+    @classmethod
+    def load(cls, header_size, state):
+        """Rebuild a keydir from dump() output."""
+        keydir = cls(header_size)
+        arena, *columns = state
+        keydir.arena = bytearray(arena)
+        for column, data in zip((keydir.key_starts, keydir.key_sizes, keydir.file_ids,
+                                 keydir.header_offsets, keydir.value_sizes, keydir.expiries), columns):
+            column.frombytes(data)
+
+        keydir.hashes = array("q", (hash(arena[start:start + size].decode())
+                                    for start, size in zip(keydir.key_starts, keydir.key_sizes)))
+        capacity = 8
+        while len(keydir.hashes) * 3 >= capacity * 2:
+            capacity *= 2
+        keydir._rehash(capacity)
+        return keydir
+
+    # ----------------------------------------------------------------
+    # Internals — caller holds self.lock
+    # ----------------------------------------------------------------
+    def _lookup(self, key_bytes, key_hash):
+        """Return (slot, entry number) of a key, or (first free slot on its chain, -1)."""
+        slots, mask, hashes = self.slots, self.mask, self.hashes
+        slot = key_hash & mask
+        while True:
+            occupant = slots[slot]
+            if occupant == EMPTY:
+                return slot, -1
+            entry = occupant - 1
+            if hashes[entry] == key_hash:
+                start = self.key_starts[entry]
+                if self.arena[start:start + self.key_sizes[entry]] == key_bytes:
+                    return slot, entry
+            slot = (slot + 1) & mask
+
+    def _entry(self, entry):
+        header_offset = self.header_offsets[entry]
+        return (self.file_ids[entry], header_offset, header_offset + self.header_size + self.key_sizes[entry],
+                self.value_sizes[entry], self.expiries[entry])
+
+    def _append(self, key_hash, key_bytes, file_id, header_offset, value_size, expiry):
+        self.hashes.append(key_hash)
+        self.key_starts.append(len(self.arena))
+        self.key_sizes.append(len(key_bytes))
+        self.arena += key_bytes
+        self.file_ids.append(file_id)
+        self.header_offsets.append(header_offset)
+        self.value_sizes.append(value_size)
+        self.expiries.append(expiry)
+
+    def _remove(self, slot, entry):
+        slots, mask, hashes = self.slots, self.mask, self.hashes
+
+        # Backward-shift deletion: pull later members of the probe chain into the hole,
+        # so lookups never need tombstones
+        hole = slot
+        while True:
+            slot = (slot + 1) & mask
+            occupant = slots[slot]
+            if occupant == EMPTY:
+                break
+            home = hashes[occupant - 1] & mask
+            # It may move into the hole only if the hole lies on its path from home
+            if (slot - home) & mask >= (slot - hole) & mask:
+                slots[hole] = occupant
+                hole = slot
+        slots[hole] = EMPTY
+
+        # Keep entries dense: the last entry takes the removed one's place
+        self.garbage += self.key_sizes[entry]
+        last = len(hashes) - 1
+        columns = (hashes, self.key_starts, self.key_sizes, self.file_ids,
+                   self.header_offsets, self.value_sizes, self.expiries)
+        if entry != last:
+            slot = hashes[last] & mask
+            while slots[slot] != last + 1:
+                slot = (slot + 1) & mask
+            slots[slot] = entry + 1
+            for column in columns:
+                column[entry] = column[last]
+        for column in columns:
+            column.pop()
+
+        if self.garbage > len(self.arena) // 2:
+            self._compact_arena()
+
+    def _compact_arena(self):
+        """Drop the key bytes of removed entries from the arena."""
+        if not self.garbage:
+            return
+        arena = bytearray()
+        key_starts = array("Q")
+        for start, size in zip(self.key_starts, self.key_sizes):
+            key_starts.append(len(arena))
+            arena += self.arena[start:start + size]
+        self.arena, self.key_starts, self.garbage = arena, key_starts, 0
+
+    def _rehash(self, capacity):
+        slots = array("I", bytes(4 * capacity))
+        mask = capacity - 1
+        for entry, key_hash in enumerate(self.hashes):
+            slot = key_hash & mask
+            while slots[slot] != EMPTY:
+                slot = (slot + 1) & mask
+            slots[slot] = entry + 1
+        self.slots, self.mask = slots, mask
+
+
+class DiskKeydir:
+    """Index backend for keyspaces larger than RAM: the index lives in a memory-mapped
+       file of 4KB bucket pages (extendible hashing: a full page splits on its own), with
+       only the page directory and an LRU cache of hot entries in memory. A cold lookup
+       costs one page read. Same dict API as CompactKeydir.
+
+       The file is only reused after a checkpoint: sync() stamps it clean with the
+       checkpoint's log position, and the first change after that marks it dirty again
+       (a crash then means rebuilding it from hints and the log)."""
+
+    def __init__(self, path, header_size, hot_keys=DEFAULT_HOT_KEYS):
+        """Create an empty keydir file at `path` (replacing any old one)."""
+        self.path = path
+        self.header_size = header_size
+        self.lock = threading.Lock()
+        self.hot = LRUCache(capacity=hot_keys)
+        self.oversize = {}  # keys too long to share a page (never in practice): kept in RAM
+
+        self.file = open(path, "w+b")
+        self.global_depth = 0
+        self.directory = array("I", [0])  # low `global_depth` bits of a key's crc32 -> page number
+        self.pages = 1
+        self.count = 0
+        self._grow(16)
+        PAGE_HEADER.pack_into(self.mm, self._page_offset(0), 0, PAGE_HEADER.size, 0)
+        self.clean = False
+        self._write_header(clean=False, token=(0, 0))
+
+    @classmethod
+    def reopen(cls, path, header_size, state, token, hot_keys=DEFAULT_HOT_KEYS):
+        """Reuse an existing keydir file described by a checkpoint's dump() state.
+           Returns None unless the file was stamped clean at exactly that checkpoint."""
+        try:
+            keydir_file = open(path, "r+b")
+        except FileNotFoundError:
+            return None
+
+        header = keydir_file.read(DISK_HEADER.size)
+        if len(header) != DISK_HEADER.size:
+            keydir_file.close()
+            return None
+        magic, clean, token_file, token_offset = DISK_HEADER.unpack(header)
+        global_depth, directory, pages, count, oversize = state
+        if (magic != DISK_MAGIC or not clean or (token_file, token_offset) != tuple(token)
+                or os.fstat(keydir_file.fileno()).st_size < (pages + 1) * PAGE_SIZE):
+            keydir_file.close()
+            return None
+
+        keydir = cls.__new__(cls)
+        keydir.path = path
+        keydir.header_size = header_size
+        keydir.lock = threading.Lock()
+        keydir.hot = LRUCache(capacity=hot_keys)
+        keydir.oversize = oversize
+        keydir.file = keydir_file
+        keydir.global_depth = global_depth
+        keydir.directory = array("I")
+        keydir.directory.frombytes(directory)
+        keydir.pages = pages
+        keydir.count = count
+        keydir.mm = mmap.mmap(keydir_file.fileno(), 0)
+        keydir.capacity = len(keydir.mm) // PAGE_SIZE - 1
+        keydir.clean = True
+        return keydir
+
+    # ----------------------------------------------------------------
+    # Dict API (only what KVStore uses)
+    # ----------------------------------------------------------------
+    def get(self, key, default=None):
+        value = self.hot.get(key)
+        if value is not None:
+            return value
+
+        key_bytes = key.encode()
+        with self.lock:
+            if key in self.oversize:
+                return self.oversize[key]
+            base = self._page_offset(self._bucket(key_bytes)[1])
+            pos = self._find(base, key_bytes)
+            if pos < 0:
+                return default
+            value = self._entry(base + pos)
+            self.hot.put(key, value)
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        file_id, header_offset, _, value_size, expiry = value
+        key_bytes = key.encode()
+        entry_size = DISK_ENTRY.size + len(key_bytes)
+
+        with self.lock:
+            self._mark_dirty()
+            self.hot.put(key, value)
+
+            if PAGE_HEADER.size + entry_size > PAGE_SIZE:
+                self.count += key not in self.oversize
+                self.oversize[key] = value
+                return
+
+            while True:
+                index, page = self._bucket(key_bytes)
+                base = self._page_offset(page)
+                pos = self._find(base, key_bytes)
+                if pos >= 0:
+                    DISK_ENTRY.pack_into(self.mm, base + pos, len(key_bytes), file_id, header_offset, value_size, expiry)
+                    return
+
+                count, used, depth = PAGE_HEADER.unpack_from(self.mm, base)
+                if used + entry_size <= PAGE_SIZE:
+                    break
+                if depth == 32:
+                    # A page full of keys with one crc32 cannot be split any further
+                    self.count += 1
+                    self.oversize[key] = value
+                    return
+                self._split(index, page, depth)  # full → split it and try again
+
+            DISK_ENTRY.pack_into(self.mm, base + used, len(key_bytes), file_id, header_offset, value_size, expiry)
+            self.mm[base + used + DISK_ENTRY.size:base + used + entry_size] = key_bytes
+            PAGE_HEADER.pack_into(self.mm, base, count + 1, used + entry_size, depth)
+            self.count += 1
+
+    def pop(self, key, default=_MISSING):
+        key_bytes = key.encode()
+        with self.lock:
+            self.hot.delete(key)
+            if key in self.oversize:
+                self._mark_dirty()
+                self.count -= 1
+                return self.oversize.pop(key)
+
+            base = self._page_offset(self._bucket(key_bytes)[1])
+            pos = self._find(base, key_bytes)
+            if pos < 0:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+
+            self._mark_dirty()
+            value = self._entry(base + pos)
+            # Close the gap: shift the rest of the page down over the removed entry
+            count, used, depth = PAGE_HEADER.unpack_from(self.mm, base)
+            entry_size = DISK_ENTRY.size + len(key_bytes)
+            self.mm[base + pos:base + used - entry_size] = self.mm[base + pos + entry_size:base + used]
+            PAGE_HEADER.pack_into(self.mm, base, count - 1, used - entry_size, depth)
+            self.count -= 1
+            return value
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        """Iterate over (key, entry) pairs page by page. Not a consistent snapshot while
+           writers run: a key moved by a concurrent page split may show up twice."""
+        page = 0
+        while True:
+            with self.lock:
+                if page >= self.pages:
+                    oversize = list(self.oversize.items())
+                    break
+                base = self._page_offset(page)
+                data = self.mm[base:base + PAGE_SIZE]
+            page += 1
+
+            count, _, _ = PAGE_HEADER.unpack_from(data)
+            pos = PAGE_HEADER.size
+            for _ in range(count):
+                key_size, file_id, header_offset, value_size, expiry = DISK_ENTRY.unpack_from(data, pos)
+                key = data[pos + DISK_ENTRY.size:pos + DISK_ENTRY.size + key_size].decode()
+                yield key, (file_id, header_offset, header_offset + self.header_size + key_size, value_size, expiry)
+                pos += DISK_ENTRY.size + key_size
+        yield from oversize
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    # ----------------------------------------------------------------
+    # Checkpoint support — pages stay in the file, the checkpoint holds the rest
+    # ----------------------------------------------------------------
+    def sync(self, token):
+        """Flush every page and stamp the file clean for the checkpoint at `token`.
+           Returns the directory and counters (marshal-friendly) for reopen()."""
+        with self.lock:
+            self.mm.flush()
+            self._write_header(clean=True, token=token)
+            self.clean = True
+            return self.global_depth, self.directory.tobytes(), self.pages, self.count, dict(self.oversize)
+
+    def close(self):
+        with self.lock:
+            self.mm.close()
+            self.file.close()
+
+    # ----------------------------------------------------------------
+    # Internals — caller holds self.lock
+    # ----------------------------------------------------------------
+    @staticmethod
+    def _page_offset(page):
+        return (page + 1) * PAGE_SIZE  # page 0 of the file is the header
+
+    def _bucket(self, key_bytes):
+        """(directory index, page number) for a key."""
+        index = zlib.crc32(key_bytes) & ((1 << self.global_depth) - 1)
+        return index, self.directory[index]
+
+    def _find(self, base, key_bytes):
+        """Offset of the key's entry inside the page at `base`, or -1."""
+        data = self.mm[base:base + PAGE_SIZE]  # one page read
+        count, used, _ = PAGE_HEADER.unpack_from(data)
+        if data.find(key_bytes, PAGE_HEADER.size, used) < 0:
+            return -1  # common miss (e.g. new keys): no walk needed
+
+        key_size = len(key_bytes)
+        pos = PAGE_HEADER.size
+        for _ in range(count):
+            size = DISK_ENTRY.unpack_from(data, pos)[0]
+            if size == key_size and data[pos + DISK_ENTRY.size:pos + DISK_ENTRY.size + size] == key_bytes:
+                return pos
+            pos += DISK_ENTRY.size + size
+        return -1
+
+    def _entry(self, offset):
+        key_size, file_id, header_offset, value_size, expiry = DISK_ENTRY.unpack_from(self.mm, offset)
+        return file_id, header_offset, header_offset + self.header_size + key_size, value_size, expiry
+
+    def _split(self, index, page, depth):
+        """Split a full page in two by the next bit of its keys' hashes."""
+        if depth == self.global_depth:
+            self.directory += self.directory  # double the directory; both halves share pages
+            self.global_depth += 1
+
+        if self.pages == self.capacity:
+            self._grow(self.capacity * 2)
+        new_page = self.pages
+        self.pages += 1
+
+        base = self._page_offset(page)
+        data = self.mm[base:base + PAGE_SIZE]
+        count, used, _ = PAGE_HEADER.unpack_from(data)
+        stay, move = bytearray(), bytearray()
+        stay_count = move_count = 0
+        pos = PAGE_HEADER.size
+        for _ in range(count):
+            key_size = DISK_ENTRY.unpack_from(data, pos)[0]
+            end = pos + DISK_ENTRY.size + key_size
+            if zlib.crc32(data[pos + DISK_ENTRY.size:end]) >> depth & 1:
+                move += data[pos:end]
+                move_count += 1
+            else:
+                stay += data[pos:end]
+                stay_count += 1
+            pos = end
+
+        for target, entries, entry_count in ((page, stay, stay_count), (new_page, move, move_count)):
+            target_base = self._page_offset(target)
+            PAGE_HEADER.pack_into(self.mm, target_base, entry_count, PAGE_HEADER.size + len(entries), depth + 1)
+            self.mm[target_base + PAGE_HEADER.size:target_base + PAGE_HEADER.size + len(entries)] = entries
+
+        # Directory slots of the old page whose bit `depth` is set now point at the new one
+        low = (index & ((1 << depth) - 1)) | (1 << depth)
+        for slot in range(low, len(self.directory), 1 << (depth + 1)):
+            self.directory[slot] = new_page
+
+    def _grow(self, capacity):
+        """Make room for `capacity` pages (remapping the file)."""
+        if hasattr(self, "mm"):
+            self.mm.close()
+        self.file.truncate((capacity + 1) * PAGE_SIZE)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = capacity
+
+    def _mark_dirty(self):
+        if self.clean:
+            self._write_header(clean=False, token=(0, 0))
+            self.mm.flush(0, PAGE_SIZE)  # on disk before any page it no longer vouches for changes
+            self.clean = False
+
+    def _write_header(self, clean, token):
+        DISK_HEADER.pack_into(self.mm, 0, DISK_MAGIC, int(clean), *token)
+
+
+class SortedKeys:
+    """Keys in sorted order for range/prefix scans, kept next to a hash index.
+
+       A sorted list plus a small unsorted buffer of new keys: inserting into a big sorted
+       list is O(n), so new keys wait in `pending` and are merged in once it grows past
+       MERGE_RATIO of the list. Scans merge the two on the fly. Callers validate every key
+       against the index, so a key that vanished without discard() (e.g. expired) is harmless."""
+
+    MERGE_RATIO = 1 / 16
+    MIN_MERGE = 1024
+
+    def __init__(self, keys=()):
+        self.lock = threading.Lock()
+        self.keys = sorted(keys)
+        self.pending = set()  # added, not merged into `keys` yet
+        self.removed = set()  # still in `keys`, but deleted
+
+    def reset(self, keys):
+        """Replace the sorted part (e.g. once an index has loaded); pending changes stay."""
+        keys = sorted(keys)
+        with self.lock:
+            self.keys = keys
+
+    def add(self, key):
+        with self.lock:
+            self.removed.discard(key)
+            if self._contains(key):
+                return  # overwrite of a known key
+            self.pending.add(key)
+            if len(self.pending) > max(self.MIN_MERGE, len(self.keys) * self.MERGE_RATIO):
+                self._merge()
+
+    def discard(self, key):
+        with self.lock:
+            self.pending.discard(key)
+            if self._contains(key):
+                self.removed.add(key)
+
+    def range(self, start=None):
+        """Iterate over keys >= start in order (a snapshot: later changes are not seen)."""
+        with self.lock:
+            # `keys` is only ever replaced, never mutated, so iterating it needs no lock
+            keys = self.keys
+            pending = sorted(self.pending)
+            removed = set(self.removed)
+
+        low = bisect.bisect_left(keys, start) if start is not None else 0
+        pending = pending[bisect.bisect_left(pending, start):] if start is not None else pending
+        last = None
+        for key in heapq.merge((keys[i] for i in range(low, len(keys))), pending):
+            if key != last and key not in removed:
+                yield key
+            last = key
+
+    def _contains(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def _merge(self):
+        keys = []
+        for key in heapq.merge(self.keys, sorted(self.pending)):
+            if key not in self.removed and (not keys or keys[-1] != key):
+                keys.append(key)
+        self.keys, self.pending, self.removed = keys, set(), set()
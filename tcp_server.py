@@ -1,12 +1,28 @@
+import argparse
+import asyncio
+import collections
+import fnmatch
+import re
+import selectors
 import socket
-import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from Engine import KVStore
-db = KVStore("data.log")
+from engine import FSYNC_ALWAYS, FSYNC_BATCH, MAX_EXPIRY, KVStore, WriteBatch
+# lazy_load: the port opens at once; the index is rebuilt in the background
+db = KVStore("data.log", lazy_load=True, ordered=True)
 
 HOST = "127.0.0.1"
 PORT = 5000
 shutdown_flag = False
+initial_protocol = "text"     # --protocol: what new connections speak ("text" or "resp")
+WELCOME = b"Welcome to KVStore Server\n"
+MAX_LINE = 1 << 20            # longest command accepted without a newline
+MAX_VALUE = 64 << 20          # binary protocol: largest value accepted in one frame
+MAX_OUTPUT_BUFFER = 1 << 20   # selector mode: stop reading from a client with this much unsent
+OFFLOAD_WORKERS = 4           # selector mode: threads running commands while store calls may block
 
 def start_server():
     global shutdown_flag
@@ -30,7 +46,8 @@ def start_server():
             continue  # retry loop, DO NOT stop server
 
         print(f"Client connected: {addr}")
-        handle_client(client_socket)
+        # One thread per client: KVStore reads run in parallel, writes are serialized inside it
+        threading.Thread(target=handle_client, args=(client_socket,), daemon=True).start()
 
     # SHUTDOWN triggered
     print("Server shutting down...")
@@ -39,128 +56,805 @@ def start_server():
 
 
 def handle_client(client_socket):
+    global shutdown_flag
+    protocol = initial_protocol
     try:
-        client_socket.sendall(b"Welcome to KVStore Server\n")
+        client_socket.sendall(greeting(protocol))
     except:
         client_socket.close()
         return
 
+    buffer = bytearray()
     while True:
         try:
-            data = client_socket.recv(1024)
+            data = client_socket.recv(65536)
         except ConnectionResetError:
             break
 
         if not data:
             break
+        if protocol == TEXT:
+            print("Client:", data[:80].decode(errors="replace").strip())
 
-        message = data.decode().strip()
-        print("Client:", message)
+        # A packet may hold several commands, or only part of one.
+        # Pipelining: run every complete one in order, answer with a single send
+        buffer += data
+        reply, action, protocol = process_input(buffer, protocol)
+        if reply:
+            client_socket.sendall(reply)
 
-        cmd, args = parse_command(message)
+        if action == SHUTDOWN:
+            shutdown_flag = True     # tell server to stop
+        if action in (CLOSE, SHUTDOWN):
+            break
 
-        # Handle parser errors
-        if cmd == "ERROR":
-            client_socket.sendall(("ERROR: " + args[0] + "\n").encode())
-            continue
+    client_socket.close()
+    print("Client disconnected")
 
-        # -----------------------
-        #   COMMAND HANDLING
-        # -----------------------
 
-        # PUT key value
-        if cmd == "PUT":
-            key = args[0]
+# ----------------------------------------------------------------
+# ASYNCIO SERVER — one coroutine per client, store calls in an executor
+# ----------------------------------------------------------------
+def start_async_server():
+    try:
+        asyncio.run(serve_async())
+    except KeyboardInterrupt:
+        print("\nServer stopped manually.")
+    print("Server shutting down...")
+    db.close()
+
 
-            # TTL only valid if it's the last two tokens: ... TTL <sec>
-            if len(args) >= 4 and args[-2].upper() == "TTL":
-                ttl = int(args[-1])
-                value = " ".join(args[1:-2])  # everything between key and TTL is value
-                db.put(key, value, ttl=ttl)
-            else:
-                # Normal PUT without TTL
-                value = " ".join(args[1:])
-                db.put(key, value)
+async def serve_async():
+    # Set by a client's SHUTDOWN; created here so it belongs to the running loop
+    stop = asyncio.Event()
+    server = await asyncio.start_server(lambda reader, writer: handle_client_async(reader, writer, stop),
+                                        HOST, PORT, backlog=1024)
+    print(f"Server running on {HOST}:{PORT} (asyncio)")
+    async with server:
+        await stop.wait()
 
-            client_socket.sendall(b"OK\n")
-            continue
 
+async def handle_client_async(reader, writer, stop):
+    loop = asyncio.get_running_loop()
+    addr = writer.get_extra_info("peername")
+    print(f"Client connected: {addr}")
+    try:
+        protocol = initial_protocol
+        writer.write(greeting(protocol))
+        buffer = bytearray()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+
+            buffer += data
+            # get/put/compact may block on disk (or on the lazy index load): keep them off the loop.
+            # One executor hop per batch of pipelined commands, not per command.
+            reply, action, protocol = await loop.run_in_executor(None, process_input, buffer, protocol)
+            if not reply:
+                continue             # only part of a command so far
+            writer.write(reply)
+            await writer.drain()     # back-pressure: stop reading while this client lags
+
+            if action == SHUTDOWN:
+                stop.set()
+            if action in (CLOSE, SHUTDOWN):
+                break
+    except ConnectionError:
+        pass                         # client went away
+    except asyncio.CancelledError:
+        pass                         # server shutting down with this client still connected
+    finally:
+        writer.close()
+    print(f"Client disconnected: {addr}")
+
+
+# ----------------------------------------------------------------
+# SELECTOR SERVER — one thread, non-blocking sockets, buffers per client
+# ----------------------------------------------------------------
+class Connection:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()      # received bytes not yet parsed into commands
+        self.outbuf = bytearray()     # replies not yet accepted by the kernel
+        self.closing = False          # EXIT/SHUTDOWN seen: close once outbuf is flushed
+        self.protocol = initial_protocol
+        self.events = 0
+        self.busy = False             # its commands are running on an offload thread
+        self.closed = False
+
+
+class Offload:
+    """Runs a client's commands on a worker thread while store calls may block, and hands
+       the results back to the selector loop through a socketpair it watches."""
+
+    def __init__(self, sel):
+        self.pool = ThreadPoolExecutor(OFFLOAD_WORKERS)
+        self.done = collections.deque()  # (conn, future); deque appends are thread-safe
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+        sel.register(self.wake_recv, selectors.EVENT_READ, self)
+
+    def submit(self, conn, max_reply):
+        # The loop leaves conn.inbuf alone while busy (no reads), so the worker owns it
+        conn.busy = True
+        future = self.pool.submit(process_input, conn.inbuf, conn.protocol, max_reply)
+        future.add_done_callback(lambda future: self._finished(conn, future))
+
+    def _finished(self, conn, future):
+        self.done.append((conn, future))
+        try:
+            self.wake_send.send(b"\0")
+        except BlockingIOError:
+            pass  # socketpair full: the loop has wakeups pending anyway
 
-        # GET key
-        if cmd == "GET":
-            key = args[0]
-            result = db.get(key)
-            if result is None:
-                client_socket.sendall(b"NOT_FOUND\n")
+    def finished(self):
+        """(conn, future) of every batch completed since the last call."""
+        try:
+            while self.wake_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.done:
+            yield self.done.popleft()
+
+    def close(self, sel):
+        self.pool.shutdown(wait=True)
+        sel.unregister(self.wake_recv)
+        self.wake_recv.close()
+        self.wake_send.close()
+
+
+def start_selector_server():
+    sel = selectors.DefaultSelector()
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # restart despite TIME_WAIT
+    server.bind((HOST, PORT))
+    server.listen(1024)
+    server.setblocking(False)
+    sel.register(server, selectors.EVENT_READ, None)
+    offload = Offload(sel)
+    print(f"Server running on {HOST}:{PORT} (selectors)")
+
+    while not shutdown_flag:
+        try:
+            events = sel.select(timeout=1)  # timeout: allow checking for ctrl+c
+        except KeyboardInterrupt:
+            print("\nServer stopped manually.")
+            break
+
+        for key, mask in events:
+            if key.data is None:
+                accept_client(sel, server, offload)
+            elif key.data is offload:
+                finish_commands(sel, offload)
             else:
-                client_socket.sendall(("VALUE " + str(result) + "\n").encode())
-            continue
+                try:
+                    service_client(sel, key.data, mask, offload)
+                except Exception as e:
+                    # One client's failure must never stop the loop serving all the others
+                    print(f"Client {key.data.addr} failed: {e!r}")
+                    close_client(sel, key.data)
 
-        # DEL key
-        if cmd == "DEL":
-            key = args[0]
-            db.delete(key)
-            client_socket.sendall(b"DELETED\n")
-            continue
-        
-        # TTL key seconds
-        if cmd == "TTL":
-            key = args[0]
-            seconds = int(args[1])
-
-            # check if key exists
-            val = db.get(key)
-            if val is None:
-                client_socket.sendall(b"NOT_FOUND\n")
-                continue
-            
-            db.put(key, val, ttl=seconds)   # re-put with new TTL
-            client_socket.sendall(b"OK\n")
-            continue
-        
-        # STATS command
-        if cmd == "STATS":
-            stats = {
-                "keys_in_index": len(db.index),
-                "keys_in_cache": len(db.cache.cache),  # assuming dict inside LRUCache
-                "put_count": db.put_count,
-                "delete_count": db.delete_count,
-                "file_size_bytes": os.path.getsize(db.filename),
-                "last_compaction_time": db.last_compaction_time
-            }
-
-            # Convert dict to string
-            text = "\n".join([f"{k}: {v}" for k, v in stats.items()])
-            client_socket.sendall((text + "\n").encode())
+    # SHUTDOWN triggered
+    print("Server shutting down...")
+    offload.close(sel)
+    for key in list(sel.get_map().values()):
+        if key.data is not None:
+            key.data.sock.close()
+    sel.close()
+    db.close()
+    server.close()
+
+
+def accept_client(sel, server, offload):
+    try:
+        client_socket, addr = server.accept()
+    except (BlockingIOError, ConnectionError):
+        return  # the client gave up before we got to it
+    client_socket.setblocking(False)
+    print(f"Client connected: {addr}")
+
+    conn = Connection(client_socket, addr)
+    conn.outbuf += greeting(conn.protocol)
+    sel.register(client_socket, selectors.EVENT_READ, conn)
+    conn.events = selectors.EVENT_READ
+    flush_client(sel, conn, offload)
+
+
+def service_client(sel, conn, mask, offload):
+    if mask & selectors.EVENT_READ:
+        try:
+            data = conn.sock.recv(65536)
+        except BlockingIOError:
+            data = None
+        except ConnectionError:
+            data = b""
+        if data == b"":
+            close_client(sel, conn)
+            return
+        if data:
+            conn.inbuf += data
+            run_commands(conn, offload)
+
+    flush_client(sel, conn, offload)
+
+
+def run_commands(conn, offload):
+    """Execute the complete commands in conn.inbuf, queueing the replies in conn.outbuf.
+       Stops early once the client has too many unsent replies; the rest of inbuf is
+       picked up when flush_client has drained some of them."""
+    if conn.closing or conn.busy or not conn.inbuf:
+        return
+
+    max_reply = MAX_OUTPUT_BUFFER - len(conn.outbuf)
+    if store_may_block():
+        offload.submit(conn, max_reply)  # finish_commands picks the replies up
+        return
+
+    # Store calls run inline otherwise: this loop is single-threaded, like the store's write path
+    try:
+        result = process_input(conn.inbuf, conn.protocol, max_reply)
+    except Exception as e:
+        result = command_failed(conn, e)
+    apply_result(conn, result)
+
+
+def store_may_block():
+    """Store calls can wait on the lazy index load (GETs of keys not loaded yet) or on
+       fsync (writes under fsync="always"/"batch"); the loop must not wait with them."""
+    return not db.ready.is_set() or db.fsync in (FSYNC_ALWAYS, FSYNC_BATCH)
+
+
+def apply_result(conn, result):
+    global shutdown_flag
+    reply, action, conn.protocol = result
+    conn.outbuf += reply
+
+    if action == SHUTDOWN:
+        shutdown_flag = True     # tell server to stop
+    if action in (CLOSE, SHUTDOWN):
+        conn.closing = True
+
+
+def command_failed(conn, error):
+    """A command raised: tell the client where its protocol allows and close only it.
+       Replies to commands before it in the same batch are lost with it."""
+    print(f"Command from {conn.addr} failed: {error!r}")
+    if conn.protocol == RESP:
+        reply = resp_error("internal error")
+    elif conn.protocol == TEXT:
+        reply = b"ERROR: Internal error\n"
+    else:
+        reply = b""  # a binary error frame needs the request id of the failed command
+    return reply, CLOSE, conn.protocol
+
+
+def finish_commands(sel, offload):
+    """Queue the replies of commands that ran on offload threads, then carry on with the
+       clients' remaining input."""
+    for conn, future in offload.finished():
+        conn.busy = False
+        if conn.closed:
             continue
-        
-        # COMPACT
-        if cmd == "COMPACT":
+        try:
+            result = future.result()
+        except Exception as e:
+            result = command_failed(conn, e)
+        apply_result(conn, result)
+        if result[0]:
+            run_commands(conn, offload)  # stopped at max_reply; otherwise only a partial command is left
+        flush_client(sel, conn, offload)
+
+
+def flush_client(sel, conn, offload):
+    """Send as much of conn.outbuf as the socket takes, then update what we wait for."""
+    if conn.outbuf:
+        try:
+            sent = conn.sock.send(conn.outbuf)
+            del conn.outbuf[:sent]
+        except BlockingIOError:
+            pass  # kernel buffer full: wait for EVENT_WRITE
+        except ConnectionError:
+            close_client(sel, conn)
+            return
+
+        # Room again: handle commands that were left waiting in inbuf
+        if conn.inbuf and len(conn.outbuf) < MAX_OUTPUT_BUFFER:
+            run_commands(conn, offload)
+            if conn.outbuf:
+                flush_client(sel, conn, offload)
+                return
+
+    if conn.closing and not conn.outbuf:
+        close_client(sel, conn)
+        return
+
+    # A slow client gets no more reads (so no more replies) until it catches up,
+    # nor does one whose commands are still running on an offload thread
+    events = selectors.EVENT_WRITE if conn.outbuf else 0
+    if not conn.closing and not conn.busy and len(conn.outbuf) < MAX_OUTPUT_BUFFER:
+        events |= selectors.EVENT_READ
+    if events != conn.events:
+        if not events:
+            sel.unregister(conn.sock)  # busy with nothing to send: finish_commands comes back
+        elif not conn.events:
+            sel.register(conn.sock, events, conn)
+        else:
+            sel.modify(conn.sock, events, conn)
+        conn.events = events
+
+
+def close_client(sel, conn):
+    if conn.closed:
+        return
+    conn.closed = True
+    if conn.events:
+        sel.unregister(conn.sock)
+    conn.sock.close()
+    print(f"Client disconnected: {conn.addr}")
+
+
+# ----------------------------------------------------------------
+# COMMAND HANDLING — shared by every server mode
+# ----------------------------------------------------------------
+# What the connection should do after sending the reply
+CLOSE = "close"
+SHUTDOWN = "shutdown"
+
+
+# Wire protocols. Connections start in TEXT (or RESP with --protocol resp);
+# the BINARY command switches a text connection to frames:
+#   request:  opcode u8 | request id u32 | key length u16 | value length u32 | ttl u32 (0 = none)
+#             followed by the key and value bytes
+#   response: status u8 | request id u32 | value length u32, followed by the value bytes
+TEXT = "text"
+BINARY = "binary"
+RESP = "resp"
+REQUEST = struct.Struct(">BIHII")
+RESPONSE = struct.Struct(">BII")
+
+OP_GET = 1
+OP_PUT = 2
+OP_DEL = 3
+OP_TTL = 4   # set the TTL of an existing key from the ttl field
+OP_EXIT = 5
+
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_ERROR = 2   # the value holds the error message
+
+
+def process_input(buffer, protocol=TEXT, max_reply=None):
+    """
+    Take the complete commands (text lines or binary frames) out of `buffer`, a bytearray,
+    and run them in order; an incomplete command stays in the buffer for the next read.
+    Stops after EXIT/SHUTDOWN, or once the replies reach `max_reply` bytes.
+    Returns (all replies joined, action, protocol); protocol changes after a BINARY command.
+    """
+    replies = bytearray()
+    action = None
+    pos = 0  # consume by offset and trim once: deleting per command would be quadratic
+    while action is None and (max_reply is None or len(replies) < max_reply):
+        if protocol == BINARY:
+            if len(buffer) - pos < REQUEST.size:
+                break
+            opcode, request_id, key_size, value_size, ttl = REQUEST.unpack_from(buffer, pos)
+            if value_size > MAX_VALUE:
+                replies += error_frame(request_id, "Value too large")
+                action = CLOSE
+                break
+            key_start = pos + REQUEST.size
+            end = key_start + key_size + value_size
+            if len(buffer) < end:
+                break
+            key = bytes(buffer[key_start:key_start + key_size])
+            value = bytes(buffer[key_start + key_size:end])
+            pos = end
+            reply, action = execute_frame(opcode, request_id, key, value, ttl)
+        elif protocol == RESP:
             try:
-                db.compact()
-                client_socket.sendall(b"OK\n")
-            except Exception as e:
-                client_socket.sendall(f"ERROR: {str(e)}\n".encode())
-            continue
-        
-        global shutdown_flag
+                command = parse_resp(buffer, pos)
+            except ValueError as e:
+                replies += resp_error(f"Protocol error: {e}")
+                action = CLOSE
+                break
+            if command is None:
+                break
+            args, pos = command
+            reply, action = execute_resp(args)
+        else:
+            end = buffer.find(b"\n", pos)
+            if end < 0:
+                if len(buffer) - pos > MAX_LINE:
+                    replies += b"ERROR: Command too long\n"
+                    action = CLOSE
+                break
+            line = bytes(buffer[pos:end])
+            pos = end + 1
+            reply, action = execute_line(line)
+            if action == BINARY:
+                protocol, action = BINARY, None   # everything after this line is frames
+        replies += reply
+
+    del buffer[:pos]
+    return bytes(replies), action, protocol
+
+
+def greeting(protocol):
+    # Redis clients expect the first bytes they read to answer their first command
+    return b"" if protocol == RESP else WELCOME
+
+
+def execute_line(line):
+    """Parse and run one raw command line (bytes, without the newline)."""
+    try:
+        return execute_command(*parse_command(line.decode()))
+    except ValueError:
+        # Non-numeric TTL/LIMIT/COUNT argument, or bytes that are not UTF-8
+        return b"ERROR: Invalid argument\n", None
 
-        if cmd == "SHUTDOWN":
-            client_socket.sendall(b"OK\n")
-            shutdown_flag = True     # tell server to stop
-            break
-        
 
-        # EXIT
-        if cmd == "EXIT":
-            client_socket.sendall(b"OK\n")
-            break
+def execute_command(cmd, args):
+    """
+    Run one parsed command against the store.
+    Returns (reply bytes, action) where action is None, CLOSE or SHUTDOWN.
+    """
+    # Blank line: nothing to do
+    if cmd is None:
+        return b"", None
 
-        # Unknown (should never reach here)
-        client_socket.sendall(b"ERROR: Unknown command\n")
+    # Handle parser errors
+    if cmd == "ERROR":
+        return ("ERROR: " + args[0] + "\n").encode(), None
 
-    client_socket.close()
-    print("Client disconnected")
+    # PUT key value
+    if cmd == "PUT":
+        key = args[0]
+
+        # TTL only valid if it's the last two tokens: ... TTL <sec>
+        if len(args) >= 4 and args[-2].upper() == "TTL":
+            ttl = int(args[-1])
+            value = " ".join(args[1:-2])  # everything between key and TTL is value
+            db.put(key, value, ttl=ttl)
+        else:
+            # Normal PUT without TTL
+            value = " ".join(args[1:])
+            db.put(key, value)
+
+        return b"OK\n", None
+
+    # GET key
+    if cmd == "GET":
+        key = args[0]
+        result = db.get(key)
+        if result is None:
+            return b"NOT_FOUND\n", None
+        return ("VALUE " + str(result) + "\n").encode(), None
+
+    # DEL key
+    if cmd == "DEL":
+        key = args[0]
+        db.delete(key)
+        return b"DELETED\n", None
+
+    # TTL key seconds
+    if cmd == "TTL":
+        key = args[0]
+        seconds = int(args[1])
+
+        if not set_ttl(key, seconds):
+            return b"NOT_FOUND\n", None
+        return b"OK\n", None
+
+    # SCAN cursor [COUNT n] → "CURSOR next" line, one "key value" line per pair, then END.
+    # Start with cursor 0; a returned cursor of 0 means the iteration is complete.
+    if cmd == "SCAN" and args and is_cursor(args[0]):
+        count = int(args[2]) if len(args) == 3 else 10
+        cursor, pairs = db.scan_cursor(args[0], count)
+        lines = [f"CURSOR {cursor}"] + [f"{key} {value}" for key, value in pairs]
+        return ("\n".join(lines + ["END"]) + "\n").encode(), None
+
+    # SCAN [START key] [END key] [PREFIX prefix] [LIMIT n]
+    # → one "key value" line per pair, in key order, then END
+    if cmd == "SCAN":
+        options = {name.lower(): value for name, value in zip(args[::2], args[1::2])}
+        if "limit" in options:
+            options["limit"] = int(options["limit"])
+
+        lines = [f"{key} {value}" for key, value in db.scan(**options)]
+        return ("\n".join(lines + ["END"]) + "\n").encode(), None
+
+    # STATS command
+    if cmd == "STATS":
+        stats = db.stats()
+
+        # Convert dict to string
+        text = "\n".join([f"{k}: {v}" for k, v in stats.items()])
+        return (text + "\n").encode(), None
+
+    # COMPACT (runs in the background; puts/gets keep being served)
+    if cmd == "COMPACT":
+        try:
+            db.compact(wait=False)
+            return b"OK\n", None
+        except Exception as e:
+            return f"ERROR: {str(e)}\n".encode(), None
+
+    if cmd == "SHUTDOWN":
+        return b"OK\n", SHUTDOWN
+
+    # BINARY → OK, then the connection speaks binary frames
+    if cmd == "BINARY":
+        return b"OK\n", BINARY
+
+    # EXIT
+    if cmd == "EXIT":
+        return b"OK\n", CLOSE
+
+    # Unknown (should never reach here)
+    return b"ERROR: Unknown command\n", None
+
+
+def execute_frame(opcode, request_id, key, value, ttl):
+    """Run one binary request. Returns (response frame, action); values are raw bytes."""
+    try:
+        key = key.decode()
+    except UnicodeDecodeError:
+        return error_frame(request_id, "Key must be UTF-8"), None
+    if opcode in (OP_PUT, OP_TTL) and ttl_too_large(ttl):
+        return error_frame(request_id, "TTL too large"), None
+
+    status, body = STATUS_OK, b""
+    if opcode == OP_GET:
+        body = db.get(key, raw=True)
+        if body is None:
+            status, body = STATUS_NOT_FOUND, b""
+    elif opcode == OP_PUT:
+        db.put(key, value, ttl=ttl)
+    elif opcode == OP_DEL:
+        db.delete(key)
+    elif opcode == OP_TTL:
+        if not set_ttl(key, ttl):
+            status = STATUS_NOT_FOUND
+    elif opcode == OP_EXIT:
+        return RESPONSE.pack(STATUS_OK, request_id, 0), CLOSE
+    else:
+        return error_frame(request_id, f"Unknown opcode: {opcode}"), None
+
+    return RESPONSE.pack(status, request_id, len(body)) + body, None
+
+
+def error_frame(request_id, message):
+    message = message.encode()
+    return RESPONSE.pack(STATUS_ERROR, request_id, len(message)) + message
+
+
+def ttl_too_large(seconds):
+    """True if `seconds` from now is past the last expiry a record can hold (in 2106)."""
+    return time.time() + seconds > MAX_EXPIRY
+
+
+def set_ttl(key, seconds):
+    """Re-put the current value of `key` with a new TTL. False if the key does not exist."""
+    value = db.get(key, raw=True)
+    if value is None:
+        return False
+    db.put(key, value, ttl=seconds)
+    return True
+
+
+# ----------------------------------------------------------------
+# RESP — the Redis protocol (RESP2), so Redis clients and redis-benchmark work
+# ----------------------------------------------------------------
+# Redis clients expect integer SCAN cursors: pack "<file id>:<offset>[:<hint position>]" as
+# file_id << 80 | offset << 40 | hint position + 1 (0 when the cursor has none)
+CURSOR_SHIFT = 40
+CURSOR_MASK = (1 << CURSOR_SHIFT) - 1
+
+# Arguments each command takes after its name: (min, max or None for any number)
+RESP_ARITY = {"GET": (1, 1), "SET": (2, 4), "DEL": (1, None), "EXPIRE": (2, 2),
+              "MGET": (1, None), "MSET": (2, None), "SCAN": (1, 5), "INFO": (0, 1),
+              "PING": (0, 1), "ECHO": (1, 1), "QUIT": (0, 0), "SHUTDOWN": (0, 1)}
+
+
+def parse_resp(buffer, pos):
+    """
+    Parse one command at `pos`: an array of bulk strings, or an inline command line.
+    Returns (args as bytes, end position), or None if it has not fully arrived yet.
+    Raises ValueError on malformed input.
+    """
+    if pos == len(buffer):
+        return None
+    if buffer[pos] != ord("*"):
+        # Inline command (redis-cli over telnet, redis-benchmark's PING_INLINE)
+        end = buffer.find(b"\n", pos)
+        if end < 0:
+            if len(buffer) - pos > MAX_LINE:
+                raise ValueError("too big inline request")
+            return None
+        return bytes(buffer[pos:end]).split(), end + 1
+
+    end = buffer.find(b"\r\n", pos)
+    if end < 0:
+        return None
+    count = int(buffer[pos + 1:end])
+    if count > MAX_LINE:
+        raise ValueError("invalid multibulk length")
+    pos = end + 2
+
+    args = []
+    for _ in range(count):
+        end = buffer.find(b"\r\n", pos)
+        if end < 0:
+            return None
+        if buffer[pos] != ord("$"):
+            raise ValueError(f"expected '$', got '{chr(buffer[pos])}'")
+        size = int(buffer[pos + 1:end])
+        if not 0 <= size <= MAX_VALUE:
+            raise ValueError("invalid bulk length")
+        start = end + 2
+        if len(buffer) < start + size + 2:
+            return None
+        args.append(bytes(buffer[start:start + size]))
+        pos = start + size + 2
+    return args, pos
+
+
+def execute_resp(args):
+    """Run one RESP command (args as bytes). Returns (RESP reply, action)."""
+    if not args:
+        return b"", None
+    name = args[0].decode(errors="replace").upper()
+    if name in RESP_ARITY:
+        least, most = RESP_ARITY[name]
+        if len(args) - 1 < least or (most is not None and len(args) - 1 > most):
+            return resp_error(f"wrong number of arguments for '{name.lower()}' command"), None
+    try:
+        return run_resp(name, [arg.decode() for arg in args[1:2]] + args[2:])
+    except UnicodeDecodeError:
+        return resp_error("keys must be UTF-8"), None
+    except (ValueError, OverflowError):
+        # A non-numeric TTL, cursor or COUNT
+        return resp_error("value is not an integer or out of range"), None
+
+
+def run_resp(name, args):
+    # args: the first one (the key, mostly) as str, the rest as raw bytes
+    if name == "GET":
+        return resp_bulk(db.get(args[0], raw=True)), None
+
+    # SET key value [EX seconds | PX milliseconds]
+    if name == "SET":
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        ttl = None
+        if options:
+            if len(options) != 2 or options[0] not in (b"EX", b"PX"):
+                return resp_error("syntax error"), None
+            amount = int(options[1])
+            # The store keeps whole seconds: round milliseconds up
+            ttl = amount if options[0] == b"EX" else -(-amount // 1000)
+            if amount <= 0 or ttl_too_large(ttl):
+                return resp_error("invalid expire time in 'set' command"), None
+        db.put(key, value, ttl=ttl)
+        return b"+OK\r\n", None
+
+    # DEL key [key ...] → number of keys that existed
+    if name == "DEL":
+        deleted = 0
+        for key in [args[0]] + [arg.decode() for arg in args[1:]]:
+            if db.exists(key):
+                db.delete(key)
+                deleted += 1
+        return b":%d\r\n" % deleted, None
+
+    # EXPIRE key seconds → 1 if the key exists
+    if name == "EXPIRE":
+        key, seconds = args[0], int(args[1])
+        if ttl_too_large(seconds):
+            return resp_error("invalid expire time in 'expire' command"), None
+        if seconds <= 0:
+            # Already expired: Redis deletes the key
+            if not db.exists(key):
+                return b":0\r\n", None
+            db.delete(key)
+            return b":1\r\n", None
+        return (b":1\r\n" if set_ttl(key, seconds) else b":0\r\n"), None
+
+    if name == "MGET":
+        keys = [args[0]] + [arg.decode() for arg in args[1:]]
+        return resp_array([resp_bulk(db.get(key, raw=True)) for key in keys]), None
+
+    # MSET key value [key value ...] — one atomic batch
+    if name == "MSET":
+        if len(args) % 2:
+            return resp_error("wrong number of arguments for 'mset' command"), None
+        batch = WriteBatch()
+        batch.put(args[0], args[1])
+        for key, value in zip(args[2::2], args[3::2]):
+            batch.put(key.decode(), value)
+        db.write(batch)
+        return b"+OK\r\n", None
+
+    # SCAN cursor [MATCH pattern] [COUNT n] → [next cursor, [key, ...]]
+    if name == "SCAN":
+        cursor = int(args[0])
+        options = [arg.upper() if i % 2 == 0 else arg for i, arg in enumerate(args[1:])]
+        if len(options) % 2 or any(option not in (b"MATCH", b"COUNT") for option in options[::2]):
+            return resp_error("syntax error"), None
+        options = dict(zip(options[::2], options[1::2]))
+        count = int(options.get(b"COUNT", 10))
+        if count < 1:
+            return resp_error("syntax error"), None
+
+        next_cursor, keys = db.keys_cursor(unpack_cursor(cursor), count)
+        if b"MATCH" in options:
+            keys = fnmatch.filter(keys, options[b"MATCH"].decode())
+        next_cursor = pack_cursor(next_cursor)
+        return resp_array([resp_bulk(next_cursor.encode()),
+                           resp_array([resp_bulk(key.encode()) for key in keys])]), None
+
+    if name == "INFO":
+        stats = db.stats()
+        lines = ["# Keyspace", f"db0:keys={stats['keys_in_index']},expires={stats['keys_with_ttl']}",
+                 "", "# Stats"]
+        lines += [f"{k}:{v}" for k, v in stats.items()]
+        return resp_bulk("\r\n".join(lines).encode() + b"\r\n"), None
+
+    if name == "PING":
+        return (resp_bulk(args[0].encode()) if args else b"+PONG\r\n"), None
+
+    if name == "ECHO":
+        return resp_bulk(args[0].encode()), None
+
+    # redis-cli and redis-benchmark ask for these on connect; an empty answer is enough
+    if name in ("COMMAND", "CONFIG"):
+        return b"*0\r\n", None
+
+    if name == "QUIT":
+        return b"+OK\r\n", CLOSE
+
+    if name == "SHUTDOWN":
+        return b"+OK\r\n", SHUTDOWN
+
+    return resp_error(f"unknown command '{name}'"), None
+
+
+def resp_bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def resp_array(items):
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+def resp_error(message):
+    return f"-ERR {message}\r\n".encode()
+
+
+def pack_cursor(cursor):
+    """scan_cursor()'s "<file id>:<offset>[:<hint position>]" as one integer (see CURSOR_SHIFT)."""
+    if cursor == "0":
+        return "0"
+    file_id, offset, *hint_pos = (int(part) for part in cursor.split(":"))
+    return str((file_id << CURSOR_SHIFT | offset) << CURSOR_SHIFT | (hint_pos[0] + 1 if hint_pos else 0))
+
+
+def unpack_cursor(number):
+    if number == 0:
+        return "0"
+    file_id, offset, hint_pos = number >> 2 * CURSOR_SHIFT, number >> CURSOR_SHIFT & CURSOR_MASK, number & CURSOR_MASK
+    return f"{file_id}:{offset}:{hint_pos - 1}" if hint_pos else f"{file_id}:{offset}"
+
+
+def is_cursor(token):
+    """SCAN cursors are "0" (start) or "<file id>:<offset>[:<hint position>]" as returned
+    by the server."""
+    return token == "0" or re.fullmatch(r"\d+:\d+(:\d+)?", token) is not None
 
 
 def parse_command(text):
@@ -198,6 +892,23 @@ def parse_command(text):
             return "ERROR", ["TTL requires: TTL key seconds"]
         return cmd, args
 
+    if cmd == "SCAN" and args and is_cursor(args[0]):
+        if len(args) not in (1, 3) or (len(args) == 3 and (args[1].upper() != "COUNT" or not args[2].isdigit()
+                                                              or int(args[2]) == 0)):
+            return "ERROR", ["SCAN requires: SCAN cursor [COUNT n]"]
+        return cmd, args
+
+    if cmd == "SCAN":
+        # Options come in NAME value pairs, each at most once
+        names = [name.upper() for name in args[::2]]
+        if (len(args) % 2 or len(set(names)) != len(names)
+                or any(name not in ("START", "END", "PREFIX", "LIMIT") for name in names)):
+            return "ERROR", ["SCAN requires: SCAN [START key] [END key] [PREFIX prefix] [LIMIT n]"]
+        if "LIMIT" in names and not args[2 * names.index("LIMIT") + 1].isdigit():
+            return "ERROR", ["SCAN LIMIT must be a non-negative integer"]
+        args[::2] = names
+        return cmd, args
+
     if cmd == "STATS":
         return "STATS", []
 
@@ -207,12 +918,32 @@ def parse_command(text):
     if cmd == "SHUTDOWN":
         return "SHUTDOWN", []
 
+    if cmd == "EXIT":
+        return "EXIT", []
+
+    if cmd == "BINARY":
+        return "BINARY", []
+
     # If unknown
     return "ERROR", [f"Unknown command: {cmd}"]
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BitPyStore TCP server")
+    parser.add_argument("--mode", choices=["asyncio", "selectors", "thread"], default="asyncio",
+                        help="asyncio: one event loop for all clients (default); "
+                             "selectors: single-threaded non-blocking loop; thread: one thread per client")
+    parser.add_argument("--protocol", choices=["text", "resp"], default="text",
+                        help="text: the line protocol (default); resp: Redis RESP2, for Redis clients")
+    options = parser.parse_args()
+    initial_protocol = options.protocol
+
     try:
-        start_server()
+        if options.mode == "asyncio":
+            start_async_server()
+        elif options.mode == "selectors":
+            start_selector_server()
+        else:
+            start_server()
     except KeyboardInterrupt:
         print("\nServer stopped manually.")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Let the tests import engine.py from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# test_engine.py is a manual scratch script (it opens a store at import), not a test module
+collect_ignore = ["test_engine.py"]
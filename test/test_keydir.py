@@ -0,0 +1,227 @@
+import random
+
+import pytest
+
+from engine import HEADER, KVStore
+from keydir import PAGE_SIZE, CompactKeydir, DiskKeydir, SortedKeys
+
+
+def entry(i, key):
+    """An index entry as KVStore builds them (value_offset follows from the key size)."""
+    header_offset = i * 100
+    return (i % 7 + 1, header_offset, header_offset + HEADER.size + len(key.encode()), i % 50, i % 3)
+
+
+def apply_random_ops(keydir, model, seed, count, keyspace):
+    rnd = random.Random(seed)
+    for i in range(count):
+        key = f"key:{rnd.randrange(keyspace)}"
+        if rnd.random() < 0.3:
+            assert keydir.pop(key, None) == model.pop(key, None)
+        else:
+            keydir[key] = model[key] = entry(i, key)
+
+
+def assert_same(keydir, model):
+    assert len(keydir) == len(model)
+    assert dict(keydir.items()) == model
+    for key, value in model.items():
+        assert keydir.get(key) == value
+
+
+# ----------------------------------------------------------------
+# CompactKeydir
+# ----------------------------------------------------------------
+def test_compact_keydir_matches_a_dict():
+    keydir = CompactKeydir(HEADER.size)
+    model = {}
+    apply_random_ops(keydir, model, seed=3, count=30000, keyspace=5000)
+
+    assert len(keydir.slots) >= 4096  # rehashed as it grew
+    assert_same(keydir, model)
+    assert keydir.get("missing") is None and "missing" not in keydir
+    with pytest.raises(KeyError):
+        keydir.pop("missing")
+
+
+def test_compact_keydir_deletes_inside_probe_chains():
+    keydir = CompactKeydir(HEADER.size, capacity=1 << 12)
+    model = {}
+    for i in range(2000):                      # ~half full: plenty of collisions
+        key = f"k{i}"
+        keydir[key] = model[key] = entry(i, key)
+
+    # Backward-shift deletion must keep every later chain member reachable, and the last
+    # entry moving into the freed row must keep its slot pointing at it
+    for i in range(0, 2000, 3):
+        key = f"k{i}"
+        assert keydir.pop(key) == model.pop(key)
+        if i % 300 == 0:
+            assert_same(keydir, model)
+    assert_same(keydir, model)
+    assert len(keydir.arena) - keydir.garbage == sum(len(key) for key in model)
+
+
+def test_compact_keydir_dump_load_round_trip():
+    keydir = CompactKeydir(HEADER.size)
+    model = {}
+    apply_random_ops(keydir, model, seed=4, count=5000, keyspace=1500)
+
+    loaded = CompactKeydir.load(HEADER.size, keydir.dump())
+    assert_same(loaded, model)
+    loaded["new"] = model["new"] = entry(1, "new")  # still a working table
+    assert_same(loaded, model)
+
+
+def test_store_checkpoints_the_compact_keydir(tmp_path):
+    path = str(tmp_path / "data.log")
+    db = KVStore(path, keydir="compact")
+    for i in range(300):
+        db.put(f"k{i}", f"v{i}")
+    db.delete("k7")
+    db.close()
+
+    db = KVStore(path, keydir="compact")
+    assert isinstance(db.index, CompactKeydir)
+    assert len(db.index) == 299 and db.get("k8") == "v8" and db.get("k7") is None
+    db.close()
+
+
+# ----------------------------------------------------------------
+# DiskKeydir
+# ----------------------------------------------------------------
+@pytest.fixture
+def keydir_path(tmp_path):
+    return str(tmp_path / "data.log.keydir")
+
+
+def test_disk_keydir_matches_a_dict(keydir_path):
+    keydir = DiskKeydir(keydir_path, HEADER.size, hot_keys=100)  # most lookups read a page
+    model = {}
+    apply_random_ops(keydir, model, seed=1, count=30000, keyspace=8000)
+
+    assert keydir.pages > 16 and keydir.global_depth >= 5  # pages split, the directory doubled
+    assert_same(keydir, model)
+    assert keydir.get("missing") is None
+    with pytest.raises(KeyError):
+        keydir.pop("missing")
+    keydir.close()
+
+
+def test_disk_keydir_delete_keeps_the_rest_of_the_page(keydir_path):
+    keydir = DiskKeydir(keydir_path, HEADER.size, hot_keys=1)  # no help from the hot cache
+    keys = [f"k{i}" for i in range(20)]                         # all on the single first page
+    for i, key in enumerate(keys):
+        keydir[key] = entry(i, key)
+    assert keydir.pages == 1
+
+    # Backward deletion from the front, the middle and the end of the page
+    for key in (keys[0], keys[10], keys[19]):
+        assert keydir.pop(key) == entry(keys.index(key), key)
+    remaining = {key: entry(i, key) for i, key in enumerate(keys) if key not in (keys[0], keys[10], keys[19])}
+    assert_same(keydir, remaining)
+    keydir.close()
+
+
+def test_disk_keydir_keeps_oversize_keys_in_ram(keydir_path):
+    keydir = DiskKeydir(keydir_path, HEADER.size)
+    huge = "h" * PAGE_SIZE  # cannot share a page with anything
+    keydir[huge] = entry(1, huge)
+    keydir["small"] = entry(2, "small")
+
+    assert huge in keydir.oversize
+    assert_same(keydir, {huge: entry(1, huge), "small": entry(2, "small")})
+    keydir.pop(huge)
+    assert len(keydir) == 1 and huge not in keydir
+    keydir.close()
+
+
+def test_disk_keydir_reopens_only_where_it_was_synced(keydir_path):
+    keydir = DiskKeydir(keydir_path, HEADER.size)
+    model = {}
+    apply_random_ops(keydir, model, seed=2, count=5000, keyspace=2000)
+    state = keydir.sync((3, 1234))
+    keydir.close()
+
+    # Another checkpoint position: the pages do not match it
+    assert DiskKeydir.reopen(keydir_path, HEADER.size, state, (3, 999)) is None
+
+    keydir = DiskKeydir.reopen(keydir_path, HEADER.size, state, (3, 1234))
+    assert keydir is not None
+    assert_same(keydir, model)
+
+    # A change after the sync, then an exit without one: the file no longer vouches for anything
+    keydir["late"] = entry(1, "late")
+    keydir.close()
+    assert DiskKeydir.reopen(keydir_path, HEADER.size, state, (3, 1234)) is None
+
+
+def test_store_reuses_the_disk_keydir_only_after_close(tmp_path):
+    path = str(tmp_path / "data.log")
+    db = KVStore(path, keydir="disk", max_file_size=2000)
+    for i in range(500):
+        db.put(f"k{i}", f"v{i}")
+    for i in range(0, 500, 5):
+        db.delete(f"k{i}")
+    db.close()
+
+    db = KVStore(path, keydir="disk")
+    assert db.index.clean  # reopened from the file, not rebuilt
+    assert len(db.index) == 400 and db.get("k1") == "v1" and db.get("k5") is None
+    db.put("k1", "changed")
+    db._close(checkpoint=False)  # crash: the file is left dirty
+
+    db = KVStore(path, keydir="disk")
+    assert not db.index.clean  # rebuilt from hints and the log
+    assert len(db.index) == 400 and db.get("k1") == "changed" and db.get("k5") is None
+    db.close()
+
+
+# ----------------------------------------------------------------
+# SortedKeys
+# ----------------------------------------------------------------
+def test_sorted_keys_match_a_sorted_set():
+    model = {f"key:{i}" for i in range(0, 400, 2)}
+    keys = SortedKeys(model)
+    keys.MIN_MERGE = 16  # merge pending keys often
+    rnd = random.Random(5)
+    for i in range(5000):
+        key = f"key:{rnd.randrange(5000)}"
+        if rnd.random() < 0.4:
+            keys.discard(key)
+            model.discard(key)
+        else:
+            keys.add(key)
+            model.add(key)
+        if i % 250 == 0:
+            assert list(keys.range()) == sorted(model)
+
+    assert keys.pending  # some keys not merged yet: range() merges on the fly
+    assert list(keys.range()) == sorted(model)
+    for start in ("", "key:1", "key:250", "key:4999", "zzz"):
+        assert list(keys.range(start)) == [key for key in sorted(model) if key >= start]
+
+
+def test_sorted_keys_range_is_a_snapshot():
+    keys = SortedKeys(["a", "c"])
+    keys.add("b")
+    scan = keys.range()
+    assert next(scan) == "a"
+    keys.add("bb")
+    keys.discard("c")
+    assert list(scan) == ["b", "c"]
+    assert list(keys.range()) == ["a", "b", "bb"]
+
+
+def test_sorted_keys_reset_keeps_pending_changes():
+    keys = SortedKeys()
+    keys.add("b")                  # written while an index loads ...
+    keys.add("x")
+    keys.discard("x")
+    keys.reset(["a", "b", "c"])    # ... which then also has "b"
+    assert list(keys.range()) == ["a", "b", "c"]
+
+    keys.discard("c")
+    keys.add("d")
+    assert list(keys.range()) == ["a", "b", "d"]
+    assert list(keys.range("b")) == ["b", "d"]
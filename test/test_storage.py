@@ -0,0 +1,560 @@
+import os
+import threading
+import time
+
+import pytest
+
+import engine
+from engine import (HEADER, MAX_EXPIRY, MAX_KEY_SIZE, KVStore, WriteBatch, encode_record,
+                    expiry_for, iter_records)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "data.log")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() as the store sees it; tests move it forward instead of sleeping."""
+    now = [time.time()]
+    monkeypatch.setattr(engine.time, "time", lambda: now[0])
+    return now
+
+
+def crash(db):
+    """Drop a store the way a crash would: no checkpoint, no hint for the active file."""
+    db._close(checkpoint=False)
+
+
+def wait_for_compaction(db):
+    """Join the background compaction, including workers it rescheduled before exiting."""
+    thread = None
+    assert db.compaction_thread is not None
+    while db.compaction_thread is not thread:
+        thread = db.compaction_thread
+        thread.join()
+
+
+def flip_byte(filename, offset):
+    with open(filename, "r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+# ----------------------------------------------------------------
+# RECORDS
+# ----------------------------------------------------------------
+def test_record_round_trip():
+    record = encode_record(b"key", b"\x00value\xff", expiry=1234)
+    size = len(record)
+
+    records = list(iter_records(memoryview(record), 0, size, size))
+    assert records == [(0, size, 0, 3, 7, 1234, 0)]
+    assert record[HEADER.size:HEADER.size + 3] == b"key"
+    assert record[HEADER.size + 3:] == b"\x00value\xff"
+
+    # Any flipped bit fails the checksum
+    damaged = bytearray(record)
+    damaged[-1] ^= 1
+    assert list(iter_records(memoryview(damaged), 0, size, size)) == []
+
+
+def test_put_get_round_trip_survives_restart(path):
+    db = KVStore(path)
+    db.put("text", "héllo")
+    db.put("blob", b"\x00\xff\xfe")
+    db.put("gone", "x")
+    db.delete("gone")
+    db.close()
+
+    db = KVStore(path)
+    assert db.get("text") == "héllo"
+    assert db.get("blob", raw=True) == b"\x00\xff\xfe"
+    assert db.get("gone") is None
+    db.close()
+
+
+def test_bytes_that_are_not_text_do_not_break_text_reads(path):
+    db = KVStore(path, ordered=True)
+    db.put("a", "text")
+    db.put("b", b"\xff\xfeok")
+    db.put("c", "more")
+
+    assert db.get("b") == "\\xff\\xfeok"
+    assert db.get("b", raw=True) == b"\xff\xfeok"  # the escaped text was not cached
+    assert dict(db.items()) == {"a": "text", "b": "\\xff\\xfeok", "c": "more"}
+    assert dict(db.scan()) == dict(db.items())
+    cursor, pairs = db.scan_cursor("0", count=10)
+    assert cursor == "0" and len(pairs) == 3
+    db.close()
+
+
+def test_key_size_and_expiry_limits(path, clock):
+    with pytest.raises(ValueError):
+        encode_record(b"k" * (MAX_KEY_SIZE + 1), b"v")
+
+    assert expiry_for(None) == 0
+    assert expiry_for(10) == int(clock[0]) + 10
+    assert expiry_for(10 ** 12) == MAX_EXPIRY
+    assert expiry_for(-5) <= int(clock[0])
+
+    db = KVStore(path)
+    db.put("forever-ish", "v", ttl=10 ** 12)  # clamped instead of overflowing the header
+    assert db.get("forever-ish") == "v"
+    db.close()
+
+
+# ----------------------------------------------------------------
+# GROUP COMMIT
+# ----------------------------------------------------------------
+def run_writers(db, threads, writes):
+    """Put writes keys from each of `threads` threads at once; returns what each one raised."""
+    errors = [None] * threads
+
+    def write(t):
+        try:
+            for i in range(writes):
+                db.put(f"t{t}:{i}", f"v{i}")
+        except OSError as e:
+            errors[t] = e
+    workers = [threading.Thread(target=write, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return errors
+
+
+def test_group_commit_shares_fsyncs(path, monkeypatch):
+    db = KVStore(path, fsync="batch")
+    fsync = os.fsync
+    calls = []
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        time.sleep(0.002)  # a disk flush: writers queue up behind it
+        fsync(fd)
+    monkeypatch.setattr(engine.os, "fsync", slow_fsync)
+
+    assert run_writers(db, threads=8, writes=50) == [None] * 8
+    assert len(calls) < 400 / 2
+    crash(db)
+
+    db = KVStore(path)
+    assert len(db.index) == 400
+    assert all(db.get(f"t{t}:{i}") == f"v{i}" for t in range(8) for i in range(50))
+    db.close()
+
+
+def test_group_commit_fsync_error_reaches_the_writers(path, monkeypatch):
+    db = KVStore(path, fsync="batch")
+    fsync = os.fsync
+    failing = [True]
+
+    def flaky_fsync(fd):
+        if failing[0]:
+            raise OSError("device gone")
+        fsync(fd)
+    monkeypatch.setattr(engine.os, "fsync", flaky_fsync)
+
+    errors = run_writers(db, threads=4, writes=5)
+    assert all(isinstance(e, OSError) and str(e) == "device gone" for e in errors)
+
+    failing[0] = False  # no group is left half-led: the next writer commits normally
+    db.put("after", "ok")
+    assert db.get("after") == "ok"
+    db.close()
+
+
+# ----------------------------------------------------------------
+# CRASH RECOVERY
+# ----------------------------------------------------------------
+def test_torn_tail_is_dropped(path):
+    db = KVStore(path)
+    db.put("a", "1")
+    db.put("b", "2")
+    active = db._data_path(db.active_id)
+    crash(db)
+
+    # A crash in the middle of appending the next record
+    with open(active, "ab") as f:
+        f.write(encode_record(b"c", b"3")[:-2])
+
+    db = KVStore(path)
+    assert db.get("a") == "1" and db.get("b") == "2" and db.get("c") is None
+    db.put("d", "4")  # lands right after the last intact record
+    crash(db)
+
+    db = KVStore(path)
+    assert db.get("b") == "2" and db.get("d") == "4"
+    db.close()
+
+
+def test_torn_write_batch_applies_nothing(path):
+    db = KVStore(path)
+    db.put("a", "1")
+    batch = WriteBatch()
+    batch.put("x", "10")
+    batch.put("y", "20")
+    batch.delete("a")
+    db.write(batch)
+    active = db._data_path(db.active_id)
+    crash(db)
+
+    # Cut the frame inside its last inner record
+    os.truncate(active, os.path.getsize(active) - 3)
+
+    db = KVStore(path)
+    assert db.get("a") == "1"
+    assert db.get("x") is None and db.get("y") is None
+    db.close()
+
+
+def test_intact_write_batch_applies_everything(path):
+    db = KVStore(path)
+    db.put("a", "1")
+    batch = WriteBatch()
+    batch.put("x", "10")
+    batch.delete("a")
+    db.write(batch)
+    crash(db)
+
+    db = KVStore(path)
+    assert db.get("a") is None and db.get("x") == "10"
+    db.close()
+
+
+@pytest.mark.parametrize("lazy_load", [False, True])
+def test_damage_before_the_end_is_not_truncated(path, lazy_load):
+    db = KVStore(path)
+    for i in range(100):
+        db.put(f"k{i:02}", "v" * 20)    # 42-byte records
+    damaged = db._data_path(db.active_id)
+    crash(db)
+    size = os.path.getsize(damaged)
+    flip_byte(damaged, 10 * 42 + 30)    # inside record 10's value
+
+    db = KVStore(path, compaction_threshold=None, lazy_load=lazy_load)
+    assert db.get("k09") == "v" * 20 and db.get("k10") is None
+    assert os.path.getsize(damaged) == size
+    db.put("new", "1")                  # appended to a new file, not after the damage
+    assert db.index["new"][0] != db.index["k09"][0]
+    crash(db)
+
+    db = KVStore(path)                  # compacts the damaged file: only what was indexed stays
+    assert db.get("k09") == "v" * 20 and db.get("k50") is None and db.get("new") == "1"
+    db.close()
+    assert os.path.getsize(damaged) < size
+    assert os.path.getsize(damaged + ".corrupt") == size
+
+
+def test_legacy_text_log_is_refused(path):
+    legacy = b'27 1234567\n{"op": "put", "key": "a"}\n'
+    with open(path, "wb") as f:
+        f.write(legacy)
+
+    with pytest.raises(ValueError):
+        KVStore(path)
+    with open(path, "rb") as f:
+        assert f.read() == legacy
+
+
+def test_corrupt_hint_falls_back_to_replay(path):
+    db = KVStore(path, max_file_size=200, compaction_threshold=None)
+    for i in range(50):
+        db.put(f"k{i}", f"v{i}")
+    db.delete("k3")
+    sealed = db.file_ids[0]
+    db.close()
+    os.remove(db.checkpoint_path)
+    flip_byte(db._hint_path(sealed), 0)
+
+    db = KVStore(path, max_file_size=200)
+    assert db.get("k0") == "v0" and db.get("k49") == "v49" and db.get("k3") is None
+    assert len(db.index) == 49
+    db.close()
+
+
+def test_corrupt_checkpoint_falls_back_to_hints(path):
+    db = KVStore(path, max_file_size=200, compaction_threshold=None)
+    for i in range(50):
+        db.put(f"k{i}", f"v{i}")
+    db.close()
+    flip_byte(db.checkpoint_path, 10)
+
+    db = KVStore(path, max_file_size=200)
+    assert len(db.index) == 50 and db.get("k42") == "v42"
+    db.close()
+
+
+def test_checkpoint_then_replay_of_later_records(path):
+    db = KVStore(path)
+    db.put("a", "1")
+    db.checkpoint()
+    db.put("a", "2")
+    db.put("b", "3")
+    crash(db)
+
+    db = KVStore(path)
+    assert db.get("a") == "2" and db.get("b") == "3"
+    db.close()
+
+
+# ----------------------------------------------------------------
+# LAZY LOADING
+# ----------------------------------------------------------------
+@pytest.fixture
+def held_loader(monkeypatch):
+    """Hold lazy loads back until the returned event is set."""
+    gate = threading.Event()
+    load = KVStore._lazy_load
+
+    def held(self, *args):
+        gate.wait()
+        load(self, *args)
+    monkeypatch.setattr(KVStore, "_lazy_load", held)
+    return gate
+
+
+def write_log(path, keydir="dict"):
+    """60 keys over several data files, every tenth deleted again."""
+    db = KVStore(path, max_file_size=300, compaction_threshold=None, keydir=keydir)
+    for i in range(60):
+        db.put(f"k{i}", f"v{i}")
+    for i in range(0, 60, 10):
+        db.delete(f"k{i}")
+    return db
+
+
+@pytest.mark.parametrize("keydir", ["dict", "disk"])
+@pytest.mark.parametrize("clean", [False, True])
+def test_lazy_load_answers_decided_keys_at_once(path, held_loader, keydir, clean):
+    db = write_log(path, keydir)
+    files = len(db.file_ids)
+    db.close() if clean else crash(db)
+
+    db = KVStore(path, keydir=keydir, lazy_load=True)
+    assert len(db.file_ids) == (files if clean else files + 1)  # a crashed active file is sealed
+    db.put("k1", "new")
+    db.delete("k2")
+    assert db.get("k1") == "new" and db.get("k2") is None  # decided by the writes: no waiting
+    assert not db.ready.is_set()
+
+    result = []
+    reader = threading.Thread(target=lambda: result.append(db.get("k3")))
+    reader.start()
+    reader.join(0.1)
+    assert reader.is_alive()  # not decided until the loader reaches it
+    held_loader.set()
+    reader.join()
+    assert result == ["v3"]
+
+    db.load_thread.join()
+    expected = {f"k{i}": f"v{i}" for i in range(60) if i % 10 and i != 2}
+    expected["k1"] = "new"
+    assert len(db.index) == len(expected)
+    assert {key: db.get(key) for key in expected} == expected
+    db.close()
+
+    db = KVStore(path, keydir=keydir)
+    assert len(db.index) == len(expected) and db.get("k1") == "new" and db.get("k2") is None
+    db.close()
+
+
+@pytest.mark.parametrize("keydir", ["dict", "disk"])
+def test_lazy_load_skips_records_the_checkpoint_covers(path, keydir):
+    db = KVStore(path, keydir=keydir)
+    for i in range(3):
+        db.put("k", f"v{i}")
+    db.put("gone", "x")
+    db.delete("gone")
+    db.close()  # checkpoint at the end of the active file, which is reused
+
+    db = KVStore(path, keydir=keydir, lazy_load=True)
+    db.load_thread.join()
+    assert db.get("k") == "v2" and db.get("gone") is None and len(db.index) == 1
+    db.close()
+
+
+def test_close_during_lazy_load_wakes_waiting_calls(path, held_loader):
+    crash(write_log(path))
+    db = KVStore(path, lazy_load=True)
+
+    errors = []
+
+    def read():
+        try:
+            db.get("k3")
+        except ValueError as e:
+            errors.append(e)
+    reader = threading.Thread(target=read)
+    reader.start()
+    closer = threading.Thread(target=db.close)
+    closer.start()
+    assert db.closed.wait(5)
+    held_loader.set()                   # the loader now finds the store closed
+    closer.join()
+    reader.join()
+
+    assert len(errors) == 1 and db.load_aborted
+    with pytest.raises(ValueError):
+        list(db.keys())
+    assert not os.path.exists(db.checkpoint_path)  # the partial index was never saved
+
+    db = KVStore(path)
+    assert db.get("k3") == "v3" and len(db.index) == 54
+    db.close()
+
+
+# ----------------------------------------------------------------
+# COMPACTION
+# ----------------------------------------------------------------
+def test_compaction_drops_deleted_and_expired_records(path, clock):
+    db = KVStore(path, max_file_size=300, compaction_threshold=None)
+    for i in range(30):
+        db.put(f"k{i}", "v" * 20, ttl=5 if i % 3 == 0 else None)
+    for i in range(1, 30, 3):
+        db.delete(f"k{i}")
+    size_before = db.stats()["file_size_bytes"]
+
+    clock[0] += 10
+    db.compact()
+    assert db.stats()["file_size_bytes"] < size_before
+    db.close()
+
+    db = KVStore(path)
+    expected = {f"k{i}" for i in range(30) if i % 3 == 2}
+    assert set(db.index.keys()) == expected
+    assert all(db.get(key) == "v" * 20 for key in expected)
+    db.close()
+
+
+def test_tombstones_survive_partial_compaction(path):
+    db = KVStore(path, max_file_size=100, compaction_threshold=None)
+    db.put("k", "old")
+    db.put("keep", "x" * 120)           # file 1 stays mostly live
+    db.delete("k")
+    db.put("pad", "p" * 120)            # the tombstone's file is mostly dead otherwise
+    tombstone_file = db.index["pad"][0]
+    db._compact_files([tombstone_file])  # older file 1 is not compacted in this run
+    crash(db)
+    os.remove(db.checkpoint_path)
+
+    db = KVStore(path)
+    assert db.get("k") is None
+    db.close()
+
+
+@pytest.mark.parametrize("read_first", [False, True])
+def test_expired_value_does_not_resurrect_older_version(path, clock, read_first):
+    db = KVStore(path, max_file_size=100)
+    db.put("K", "v1")                   # file 1, kept live by "keep"
+    db.put("keep", "k" * 120)
+    db.put("K", "v2" + "x" * 200, ttl=1)  # file 2: almost only this value
+    db.put("z", "z" * 120)
+
+    clock[0] += 5
+    if read_first:
+        assert db.get("K") is None      # drops the expired entry from the index
+    db.put("w", "w")                    # the write sweeps expiry: file 2 becomes a candidate
+    wait_for_compaction(db)
+    crash(db)
+    if os.path.exists(db.checkpoint_path):
+        os.remove(db.checkpoint_path)
+
+    db = KVStore(path, max_file_size=100)
+    assert db.get("K") is None
+    db.close()
+
+
+def test_file_sealed_mostly_dead_is_compacted(path):
+    db = KVStore(path, max_file_size=50 * 60)  # 60-byte records
+    for i in range(50):
+        db.put("k", f"{i:040}")         # overwrites inside the active file: never a candidate
+    first = db.file_ids[0]
+    size = os.path.getsize(db._data_path(first))
+    db.put("other", "x")                # rolls it over
+
+    wait_for_compaction(db)
+    assert os.path.getsize(db._data_path(first)) < size // 10
+    assert db.get("k") == f"{49:040}"
+    db.close()
+
+
+def test_expired_records_count_as_dead_without_reads(path, clock):
+    db = KVStore(path, max_file_size=2000, compaction_threshold=None)
+    for i in range(40):
+        db.put(f"t{i}", "v" * 40, ttl=1)
+    db.put("x", "x" * 2000)
+    stats = db.stats()
+    assert stats["keys_with_ttl"] == 40
+
+    clock[0] += 5
+    expired = db.stats()
+    assert expired["keys_with_ttl"] == 0
+    assert expired["dead_bytes"] > stats["dead_bytes"] + 40 * 40
+    db.close()
+
+
+# ----------------------------------------------------------------
+# ITERATION
+# ----------------------------------------------------------------
+def test_iteration_ignores_a_corrupt_hint(path):
+    db = KVStore(path, max_file_size=200, compaction_threshold=None)
+    for i in range(50):
+        db.put(f"k{i}", f"v{i}")
+    sealed = db.file_ids[0]
+    db.close()
+    flip_byte(db._hint_path(sealed), 17)  # key_size of its first entry: every entry misaligns
+
+    db = KVStore(path)                    # from the checkpoint: the hint is not read here
+    expected = {f"k{i}" for i in range(50)}
+    assert set(db.keys()) == expected
+
+    keys, cursor = [], "0"
+    while True:
+        cursor, page = db.keys_cursor(cursor, count=7)
+        keys += page
+        if cursor == "0":
+            break
+    assert sorted(keys) == sorted(expected)
+    db.close()
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_scan_ranges_and_prefixes(path, clock, ordered):
+    db = KVStore(path, ordered=ordered)
+    for i in range(30):
+        db.put(f"user:{i:02d}", f"u{i}")
+        db.put(f"item:{i:02d}", f"i{i}")
+    db.delete("user:03")
+    db.put("user:04", "short-lived", ttl=5)
+    clock[0] += 10
+    users = [(f"user:{i:02d}", f"u{i}") for i in range(30) if i not in (3, 4)]
+
+    assert list(db.scan(prefix="user:")) == users
+    assert list(db.scan(prefix="user:", start="a")) == users  # start before the prefix
+    assert list(db.scan(prefix="user:", limit=5)) == users[:5]
+    assert list(db.scan(start="user:10", end="user:20")) == users[8:18]
+    assert list(db.scan(prefix="user:2", start="user:25")) == users[23:]
+    assert list(db.scan(start="item:28", limit=4)) == [("item:28", "i28"), ("item:29", "i29")] + users[:2]
+    assert list(db.scan(end="item:02")) == [("item:00", "i0"), ("item:01", "i1")]
+    assert list(db.scan(prefix="zzz")) == []
+    db.close()
+
+
+def test_ordered_index_keeps_writes_made_during_a_lazy_load(path, held_loader):
+    write_log(path).close()
+    db = KVStore(path, lazy_load=True, ordered=True)
+    db.put("k0", "back")
+    db.put("a", "new")
+    db.delete("k1")
+    held_loader.set()
+
+    expected = {f"k{i}": f"v{i}" for i in range(60) if i % 10 and i != 1}
+    expected.update(k0="back", a="new")
+    assert list(db.scan()) == sorted(expected.items())
+    db.close()
@@ -0,0 +1,197 @@
+import os
+
+import pytest
+
+from engine import KVStore
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """The tcp_server module. Importing it opens a store named data.log in the working
+       directory, so that happens in a scratch directory and the store is closed again."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("server"))
+    try:
+        import tcp_server
+        tcp_server.db.close()  # before leaving: its paths are relative
+    finally:
+        os.chdir(cwd)
+    return tcp_server
+
+
+@pytest.fixture
+def db(server, tmp_path, monkeypatch):
+    store = KVStore(str(tmp_path / "data.log"))
+    monkeypatch.setattr(server, "db", store)
+    yield store
+    store.close()
+
+
+def resp_command(*args):
+    return b"*%d\r\n" % len(args) + b"".join(b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in args)
+
+
+def feed(server, data, protocol, step):
+    """Run `data` through process_input `step` bytes at a time, as separate packets would
+       arrive. Returns (all replies, last action, protocol, what is left in the buffer)."""
+    buffer = bytearray()
+    replies = b""
+    action = None
+    for i in range(0, len(data), step):
+        buffer += data[i:i + step]
+        reply, action, protocol = server.process_input(buffer, protocol)
+        replies += reply
+    return replies, action, protocol, bytes(buffer)
+
+
+# ----------------------------------------------------------------
+# RESP
+# ----------------------------------------------------------------
+def test_parse_resp_waits_for_a_whole_command(server):
+    command = resp_command(b"SET", b"key", b"va\r\nlue")
+    for end in range(len(command)):
+        assert server.parse_resp(bytearray(command[:end]), 0) is None
+    assert server.parse_resp(bytearray(command), 0) == ([b"SET", b"key", b"va\r\nlue"], len(command))
+
+
+def test_parse_resp_pipelined_and_inline_commands(server):
+    buffer = bytearray(resp_command(b"PING") + b"GET  key\r\n" + resp_command(b"ECHO", b""))
+    commands = []
+    pos = 0
+    while True:
+        command = server.parse_resp(buffer, pos)
+        if command is None:
+            break
+        args, pos = command
+        commands.append(args)
+    assert commands == [[b"PING"], [b"GET", b"key"], [b"ECHO", b""]]
+    assert pos == len(buffer)
+
+
+@pytest.mark.parametrize("data", [
+    b"*1\r\n:5\r\n",                                    # not a bulk string
+    b"*1\r\n$%d\r\n" % ((64 << 20) + 1),                # bulk longer than MAX_VALUE
+    b"*%d\r\n" % ((1 << 20) + 1),                       # more arguments than MAX_LINE
+    b"*x\r\n",                                          # not a number
+])
+def test_parse_resp_rejects_malformed_input(server, data):
+    with pytest.raises(ValueError):
+        server.parse_resp(bytearray(data), 0)
+
+
+def test_parse_resp_limits_inline_commands(server):
+    assert server.parse_resp(bytearray(b"P" * server.MAX_LINE), 0) is None  # may still end
+    with pytest.raises(ValueError):
+        server.parse_resp(bytearray(b"P" * (server.MAX_LINE + 1)), 0)
+
+
+@pytest.mark.parametrize("step", [1, 7, 1000])
+def test_resp_pipeline_in_split_packets(server, db, step):
+    data = (resp_command(b"SET", b"a", b"1") + resp_command(b"SET", b"b", b"\xff\x00", b"EX", b"100")
+            + resp_command(b"GET", b"b") + resp_command(b"DEL", b"a", b"zz") + resp_command(b"GET", b"a"))
+    replies, action, protocol, rest = feed(server, data, server.RESP, step)
+    assert replies == b"+OK\r\n+OK\r\n$2\r\n\xff\x00\r\n:1\r\n$-1\r\n"
+    assert action is None and protocol == server.RESP and rest == b""
+
+
+def test_resp_protocol_error_closes_the_connection(server, db):
+    replies, action, _, _ = feed(server, resp_command(b"PING") + b"*1\r\n:5\r\n", server.RESP, 100)
+    assert replies.startswith(b"+PONG\r\n-ERR Protocol error")
+    assert action == server.CLOSE
+
+
+@pytest.mark.parametrize("cursor", ["0", "1:0", "3:120", "3:120:0", "3:120:45", "4294967295:1099511627775:1099511627774"])
+def test_resp_cursor_round_trip(server, cursor):
+    assert server.unpack_cursor(int(server.pack_cursor(cursor))) == cursor
+
+
+def test_resp_scan_pages_through_every_key(server, db):
+    for i in range(40):
+        db.put(f"k{i}", "v")
+    db.delete("k3")
+
+    keys = []
+    cursor = b"0"
+    while True:
+        reply, _, _ = server.process_input(bytearray(resp_command(b"SCAN", cursor, b"COUNT", b"7")), server.RESP)
+        # *2 / $n / cursor / *count / then $n / key per key
+        lines = reply.split(b"\r\n")
+        cursor = lines[2]
+        keys += lines[5:-1:2]
+        if cursor == b"0":
+            break
+    assert sorted(keys) == sorted(f"k{i}".encode() for i in range(40) if i != 3)
+
+
+def test_resp_rejects_expire_times_past_the_record_range(server, db):
+    too_far = str(server.MAX_EXPIRY).encode()
+    data = (resp_command(b"SET", b"k", b"v", b"EX", too_far) + resp_command(b"SET", b"k", b"v", b"PX", b"0")
+            + resp_command(b"SET", b"k", b"v") + resp_command(b"EXPIRE", b"k", too_far)
+            + resp_command(b"EXPIRE", b"k", b"0") + resp_command(b"GET", b"k"))
+    replies, _, _, _ = feed(server, data, server.RESP, len(data))
+    assert replies.split(b"\r\n")[:-1] == [
+        b"-ERR invalid expire time in 'set' command", b"-ERR invalid expire time in 'set' command",
+        b"+OK", b"-ERR invalid expire time in 'expire' command", b":1", b"$-1"]
+
+
+# ----------------------------------------------------------------
+# TEXT AND BINARY FRAMING
+# ----------------------------------------------------------------
+def frame(server, opcode, request_id, key=b"", value=b"", ttl=0):
+    return server.REQUEST.pack(opcode, request_id, len(key), len(value), ttl) + key + value
+
+
+def responses(server, data):
+    """Split response frames into (status, request id, value) tuples."""
+    parsed = []
+    while data:
+        status, request_id, size = server.RESPONSE.unpack_from(data)
+        start = server.RESPONSE.size
+        parsed.append((status, request_id, data[start:start + size]))
+        data = data[start + size:]
+    return parsed
+
+
+@pytest.mark.parametrize("step", [1, 5, 10000])
+def test_switch_to_binary_in_the_middle_of_a_batch(server, db, step):
+    data = (b"PUT a text\nBINARY\n"
+            + frame(server, server.OP_PUT, 1, b"b", b"\x00\xff" * 100)
+            + frame(server, server.OP_GET, 2, b"a")
+            + frame(server, server.OP_GET, 3, b"b")
+            + frame(server, server.OP_DEL, 4, b"b")
+            + frame(server, server.OP_GET, 5, b"b")
+            + frame(server, server.OP_GET, 6, b"b")[:7])  # the next frame has not fully arrived
+    replies, action, protocol, rest = feed(server, data, server.TEXT, step)
+
+    assert replies.startswith(b"OK\nOK\n")
+    assert protocol == server.BINARY and action is None
+    assert responses(server, replies[len(b"OK\nOK\n"):]) == [
+        (server.STATUS_OK, 1, b""), (server.STATUS_OK, 2, b"text"), (server.STATUS_OK, 3, b"\x00\xff" * 100),
+        (server.STATUS_OK, 4, b""), (server.STATUS_NOT_FOUND, 5, b"")]
+    assert rest == frame(server, server.OP_GET, 6, b"b")[:7]
+
+
+def test_binary_frame_limits(server, db):
+    huge = server.REQUEST.pack(server.OP_PUT, 7, 1, server.MAX_VALUE + 1, 0) + b"k"
+    replies, action, _ = server.process_input(bytearray(huge), server.BINARY)
+    assert responses(server, replies) == [(server.STATUS_ERROR, 7, b"Value too large")]
+    assert action == server.CLOSE
+
+    too_far = frame(server, server.OP_PUT, 8, b"k", b"v", ttl=server.MAX_EXPIRY)
+    replies, action, _ = server.process_input(bytearray(too_far), server.BINARY)
+    assert responses(server, replies) == [(server.STATUS_ERROR, 8, b"TTL too large")]
+    assert action is None and db.get("k") is None
+
+
+def test_text_line_limit(server, db):
+    buffer = bytearray(b"PUT k " + b"v" * server.MAX_LINE)
+    replies, action, _ = server.process_input(buffer, server.TEXT)
+    assert replies == b"ERROR: Command too long\n" and action == server.CLOSE
+
+
+def test_text_reads_of_binary_values(server, db):
+    data = frame(server, server.OP_PUT, 1, b"b", b"\xff\xfe")
+    feed(server, data, server.BINARY, len(data))
+
+    replies, _, _, _ = feed(server, b"GET b\nSCAN 0\n", server.TEXT, 100)
+    assert replies == b"VALUE \\xff\\xfe\nCURSOR 0\nb \\xff\\xfe\nEND\n"